@@ -1 +1,10 @@
-from .purehtml import purify_html_str, purify_html_file, purify_html_files
+from .purehtml import (
+    purify_html_str,
+    iter_purify_html_chunks,
+    purify_html_file,
+    purify_html_files,
+    iter_purify_html_files,
+    iter_purify_html_sources,
+)
+from .aio import apurify_html_str, apurify_html_files
+from .chunks import join_chunks
@@ -0,0 +1,317 @@
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import itertools
+import os
+import weakref
+
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, Literal, Union
+
+from .parsers import ParserType
+from .purehtml import HTMLPurifier, get_worker_purifier
+
+
+def purify_html_str_task(
+    config: dict, html_str: Union[str, bytes], encoding=None, url=None
+):
+    return get_worker_purifier(config).purify_str(html_str, encoding=encoding, url=url)
+
+
+# process pool shared by one-off calls, created on first use
+SHARED_EXECUTOR = None
+# semaphores shared by one-off calls, one per event loop, as they are bound to it
+SHARED_SEMAPHORES = weakref.WeakKeyDictionary()
+
+
+def get_shared_executor() -> concurrent.futures.ProcessPoolExecutor:
+    global SHARED_EXECUTOR
+    if SHARED_EXECUTOR is None:
+        SHARED_EXECUTOR = concurrent.futures.ProcessPoolExecutor()
+    return SHARED_EXECUTOR
+
+
+def get_shared_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in SHARED_SEMAPHORES:
+        SHARED_SEMAPHORES[loop] = asyncio.Semaphore((os.cpu_count() or 1) * 2)
+    return SHARED_SEMAPHORES[loop]
+
+
+def write_output_file(output_path: Path, output: str):
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as wf:
+        wf.write(output)
+
+
+class AsyncHTMLPurifier:
+    # Runs purification in a worker pool, so that the event loop is never blocked.
+    # Processes are the default, as threads still hold the GIL while purifying.
+    # - executor: "thread", "process", an Executor,
+    #   or None to use the default executor of the loop
+    # - max_concurrency: max documents in the pool at once, others wait for a slot
+    # - semaphore: shared by purifiers to limit them together, instead of `max_concurrency`
+    # - timeout: seconds per document, after which `asyncio.TimeoutError` is raised;
+    #   a document which is already running can not be interrupted,
+    #   its result is dropped once done
+    # File reads and writes run in the default executor of the loop.
+    def __init__(
+        self,
+        purifier: HTMLPurifier,
+        executor: Union[
+            Literal["thread", "process"], concurrent.futures.Executor, None
+        ] = "process",
+        max_workers: int = None,
+        max_concurrency: int = None,
+        timeout: float = None,
+        semaphore: asyncio.Semaphore = None,
+    ):
+        self.purifier = purifier
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers * 2
+        self.timeout = timeout
+        self.owns_executor = executor in ("thread", "process")
+        if executor == "thread":
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        elif executor == "process":
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+        elif executor is None or isinstance(executor, concurrent.futures.Executor):
+            self.executor = executor
+        else:
+            raise ValueError(f"Unknown executor: {executor}")
+        self.semaphore = semaphore
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        # created lazily, to be bound to the running loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphore
+
+    async def purify_str(
+        self,
+        html_str: Union[str, bytes],
+        encoding: str = None,
+        timeout: float = None,
+        url: str = None,
+    ) -> str:
+        loop = asyncio.get_running_loop()
+        timeout = timeout or self.timeout
+        async with self.get_semaphore():
+            if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+                # workers rebuild the purifier from its config
+                future = loop.run_in_executor(
+                    self.executor,
+                    purify_html_str_task,
+                    # built per call, to send packs registered after init
+                    self.purifier.get_config(),
+                    html_str,
+                    encoding,
+                    url,
+                )
+            else:
+                # purifier is thread-safe, so threads share it
+                future = loop.run_in_executor(
+                    self.executor,
+                    functools.partial(
+                        self.purifier.purify_str, html_str, encoding, url=url
+                    ),
+                )
+            # on timeout or cancellation, a document still waiting for a worker
+            # is cancelled as well
+            return await asyncio.wait_for(future, timeout)
+
+    async def purify_file(
+        self,
+        html_path: Union[Path, str],
+        save: bool = True,
+        output_path: Union[Path, str] = None,
+        encoding: str = None,
+        timeout: float = None,
+        url: str = None,
+    ) -> dict:
+        loop = asyncio.get_running_loop()
+        html_bytes = await loop.run_in_executor(None, Path(html_path).read_bytes)
+        output = await self.purify_str(
+            html_bytes, encoding=encoding, timeout=timeout, url=url
+        )
+        if save:
+            output_path = Path(output_path or self.purifier.get_output_path(html_path))
+            await loop.run_in_executor(None, write_output_file, output_path, output)
+        return {"path": html_path, "output_path": output_path, "output": output}
+
+    def make_item(self, html_path, task: asyncio.Task) -> dict:
+        # failed documents are yielded with `error`, instead of stopping the batch
+        item = {
+            "path": html_path,
+            "output": None,
+            "output_path": None,
+            "format": self.purifier.output_format,
+            "skipped": False,
+            "error": None,
+        }
+        if task.exception() is not None:
+            item["error"] = repr(task.exception())
+        else:
+            result = task.result()
+            item["output"] = result["output"]
+            item["output_path"] = result["output_path"]
+        return item
+
+    async def iter_purify_files(
+        self,
+        html_paths: Iterable[Union[Path, str]],
+        save: bool = True,
+        ordered: bool = False,
+        timeout: float = None,
+    ) -> AsyncIterator[dict]:
+        # only a window of `max_concurrency` tasks exists at once,
+        # so long or lazy path iterables do not create all tasks upfront
+        html_paths = iter(html_paths)
+        task_paths = collections.OrderedDict()
+        try:
+            while True:
+                for html_path in itertools.islice(
+                    html_paths, self.max_concurrency - len(task_paths)
+                ):
+                    task = asyncio.ensure_future(
+                        self.purify_file(html_path, save=save, timeout=timeout)
+                    )
+                    task_paths[task] = html_path
+                if not task_paths:
+                    return
+                if ordered:
+                    head_task = next(iter(task_paths))
+                    await asyncio.wait([head_task])
+                    done_tasks = [head_task]
+                else:
+                    done_tasks, _ = await asyncio.wait(
+                        task_paths, return_when=asyncio.FIRST_COMPLETED
+                    )
+                for task in done_tasks:
+                    yield self.make_item(task_paths.pop(task), task)
+        finally:
+            for task in task_paths:
+                task.cancel()
+
+    async def purify_files(
+        self,
+        html_paths: Iterable[Union[Path, str]],
+        save: bool = True,
+        timeout: float = None,
+    ) -> list[dict]:
+        return [
+            item
+            async for item in self.iter_purify_files(
+                html_paths, save=save, ordered=True, timeout=timeout
+            )
+        ]
+
+    def close(self):
+        if self.owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+async def apurify_html_str(
+    html_str: Union[str, bytes],
+    verbose: bool = False,
+    output_format: Literal["markdown", "html"] = "html",
+    keep_href: bool = False,
+    keep_format_tags: bool = True,
+    keep_group_tags: bool = True,
+    math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    markdown_backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    cache: bool = False,
+    cache_path: Union[Path, str] = None,
+    timeout: float = None,
+    url: str = None,
+):
+    purifier = HTMLPurifier(
+        verbose=verbose,
+        output_format=output_format,
+        keep_href=keep_href,
+        keep_format_tags=keep_format_tags,
+        keep_group_tags=keep_group_tags,
+        math_style=math_style,
+        markdown_backend=markdown_backend,
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        cache=cache,
+        cache_path=cache_path,
+    )
+    # run in a process pool shared by all calls, instead of creating a pool per call,
+    # and limit documents in it by a semaphore shared by all calls
+    async_purifier = AsyncHTMLPurifier(
+        purifier,
+        executor=get_shared_executor(),
+        timeout=timeout,
+        semaphore=get_shared_semaphore(),
+    )
+    return await async_purifier.purify_str(html_str, url=url)
+
+
+async def apurify_html_files(
+    html_paths: Iterable[Union[Path, str]],
+    verbose: bool = False,
+    output_format: Literal["markdown", "html"] = "html",
+    keep_href: bool = False,
+    keep_format_tags: bool = True,
+    keep_group_tags: bool = True,
+    math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    markdown_backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    cache: bool = False,
+    cache_path: Union[Path, str] = None,
+    executor: Union[
+        Literal["thread", "process"], concurrent.futures.Executor, None
+    ] = "process",
+    max_workers: int = None,
+    max_concurrency: int = None,
+    timeout: float = None,
+):
+    purifier = HTMLPurifier(
+        verbose=verbose,
+        output_format=output_format,
+        keep_href=keep_href,
+        keep_format_tags=keep_format_tags,
+        keep_group_tags=keep_group_tags,
+        math_style=math_style,
+        markdown_backend=markdown_backend,
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        cache=cache,
+        cache_path=cache_path,
+    )
+    async with AsyncHTMLPurifier(
+        purifier,
+        executor=executor,
+        max_workers=max_workers,
+        max_concurrency=max_concurrency,
+        timeout=timeout,
+    ) as async_purifier:
+        return await async_purifier.purify_files(html_paths)
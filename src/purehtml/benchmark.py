@@ -0,0 +1,315 @@
+import argparse
+import hashlib
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Union
+
+from tclogger import logger
+
+from .metrics import get_percentile
+from .purehtml import HTMLPurifier
+
+SAMPLES_ROOT = Path(__file__).parent / "samples"
+GOLDEN_PATH = SAMPLES_ROOT / "golden.json"
+# throughput can drop by this ratio against the baseline before failing
+DEFAULT_TOLERANCE = 0.15
+
+
+def get_benchmark_configs() -> list[dict]:
+    configs = []
+    for (
+        output_format,
+        math_style,
+        (keep_href, keep_format, keep_group),
+    ) in itertools.product(
+        ["html", "markdown"],
+        ["latex", "latex_in_tag", "html"],
+        [(False, True, True), (True, True, True), (False, False, False)],
+    ):
+        configs.append(
+            {
+                "output_format": output_format,
+                "math_style": math_style,
+                "keep_href": keep_href,
+                "keep_format_tags": keep_format,
+                "keep_group_tags": keep_group,
+            }
+        )
+    return configs
+
+
+def get_config_name(config: dict) -> str:
+    name = (
+        f"{config['output_format']}-{config['math_style']}"
+        f"-href{config['keep_href']:d}"
+        f"-format{config['keep_format_tags']:d}"
+        f"-group{config['keep_group_tags']:d}"
+    )
+    # non-default backends may change outputs, so they get their own golden entries
+    for key in ["markdown_backend", "parser", "prestrip", "site_rules"]:
+        if key in config:
+            name += f"-{key}={config[key]}"
+    return name
+
+
+def get_output_hash(output: str) -> str:
+    return hashlib.blake2b(output.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def load_json(path: Union[Path, str]) -> dict:
+    if not path or not Path(path).exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as rf:
+        return json.load(rf)
+
+
+def save_json(data: dict, path: Union[Path, str]):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as wf:
+        json.dump(data, wf, indent=2, ensure_ascii=False, sort_keys=True)
+        wf.write("\n")
+
+
+class HTMLPurifierBenchmark:
+    # Runs each sample through each config, and reports throughput, latency
+    # percentiles and peak memory of each config.
+    # Outputs are checked against golden hashes, and throughputs against a baseline.
+    def __init__(
+        self,
+        html_paths: list[Union[Path, str]] = None,
+        configs: list[dict] = None,
+        repeat: int = 3,
+        warmup: int = 1,
+        measure_memory: bool = True,
+        extra_settings: dict = None,
+    ):
+        if html_paths is None:
+            html_paths = sorted(SAMPLES_ROOT.glob("*.html"), key=lambda x: x.name)
+        self.html_paths = [Path(html_path) for html_path in html_paths]
+        self.configs = [
+            {**config, **(extra_settings or {})}
+            for config in (configs or get_benchmark_configs())
+        ]
+        self.repeat = repeat
+        self.warmup = warmup
+        self.measure_memory = measure_memory
+        self.html_strs = {}
+        for html_path in self.html_paths:
+            with open(html_path, "r", encoding="utf-8", errors="ignore") as rf:
+                self.html_strs[html_path.name] = rf.read()
+        self.input_bytes = sum(
+            len(html_str.encode("utf-8")) for html_str in self.html_strs.values()
+        )
+
+    def measure_peak_memory(self, purifier: HTMLPurifier) -> int:
+        # run separately from timing, as tracemalloc slows down allocations a lot
+        tracemalloc.start()
+        peak_bytes = 0
+        for html_str in self.html_strs.values():
+            tracemalloc.reset_peak()
+            purifier.purify_str(html_str)
+            peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        return peak_bytes
+
+    def run_config(self, config: dict) -> dict:
+        purifier = HTMLPurifier(**config)
+        outputs = {}
+        for _ in range(self.warmup):
+            for name, html_str in self.html_strs.items():
+                outputs[name] = purifier.purify_str(html_str)
+        latencies = []
+        total_seconds = 0.0
+        for _ in range(self.repeat):
+            for name, html_str in self.html_strs.items():
+                start = time.perf_counter()
+                outputs[name] = purifier.purify_str(html_str)
+                latency = time.perf_counter() - start
+                latencies.append(latency)
+                total_seconds += latency
+        latencies.sort()
+        doc_count = len(latencies)
+        result = {
+            "config": config,
+            "docs": doc_count,
+            "seconds": total_seconds,
+            "docs_per_sec": doc_count / total_seconds if total_seconds else 0.0,
+            "mb_per_sec": (
+                self.input_bytes * self.repeat / 1e6 / total_seconds
+                if total_seconds
+                else 0.0
+            ),
+            "latency_ms": {
+                f"p{percentile}": get_percentile(latencies, percentile) * 1000
+                for percentile in [50, 90, 99]
+            },
+            "output_hashes": {
+                name: get_output_hash(output) for name, output in outputs.items()
+            },
+        }
+        result["latency_ms"]["max"] = latencies[-1] * 1000 if latencies else 0.0
+        if self.measure_memory:
+            result["peak_memory_mb"] = self.measure_peak_memory(purifier) / 1e6
+        return result
+
+    def run(self) -> dict:
+        results = {}
+        for config in self.configs:
+            name = get_config_name(config)
+            result = self.run_config(config)
+            results[name] = result
+            memory_str = (
+                f", {result['peak_memory_mb']:.1f} MB peak"
+                if "peak_memory_mb" in result
+                else ""
+            )
+            logger.mesg(
+                f"  * {name}: "
+                f"{result['docs_per_sec']:.2f} docs/s, "
+                f"{result['mb_per_sec']:.2f} MB/s, "
+                f"p50={result['latency_ms']['p50']:.1f}ms, "
+                f"p99={result['latency_ms']['p99']:.1f}ms"
+                f"{memory_str}"
+            )
+        return {
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "samples": [html_path.name for html_path in self.html_paths],
+                "input_bytes": self.input_bytes,
+                "repeat": self.repeat,
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            },
+            "results": results,
+        }
+
+    def check_golden(self, report: dict, golden: dict) -> list[str]:
+        # return names of outputs which differ from golden hashes
+        mismatches = []
+        for name, result in report["results"].items():
+            golden_hashes = golden.get(name)
+            if golden_hashes is None:
+                logger.warn(f"  × No golden outputs for: {name}")
+                continue
+            for sample_name, output_hash in result["output_hashes"].items():
+                golden_hash = golden_hashes.get(sample_name)
+                if golden_hash is not None and golden_hash != output_hash:
+                    mismatches.append(f"{name}: {sample_name}")
+        return mismatches
+
+    def check_baseline(
+        self, report: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+    ) -> list[str]:
+        # return configs whose throughput dropped more than `tolerance` from baseline
+        regressions = []
+        baseline_results = baseline.get("results", {})
+        for name, result in report["results"].items():
+            if name not in baseline_results:
+                continue
+            base_docs_per_sec = baseline_results[name]["docs_per_sec"]
+            docs_per_sec = result["docs_per_sec"]
+            if docs_per_sec < base_docs_per_sec * (1 - tolerance):
+                regressions.append(
+                    f"{name}: {docs_per_sec:.2f} docs/s "
+                    f"< {base_docs_per_sec:.2f} docs/s (baseline)"
+                )
+        return regressions
+
+
+def main(args: list[str] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m purehtml.benchmark",
+        description="Benchmark purehtml over the bundled samples and all configs",
+    )
+    arg_parser.add_argument("--samples", type=str, help="Dir of html files")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--warmup", type=int, default=1)
+    arg_parser.add_argument("--no-memory", action="store_true")
+    arg_parser.add_argument("--parser", type=str)
+    arg_parser.add_argument("--markdown-backend", type=str)
+    arg_parser.add_argument("--prestrip", action="store_true")
+    arg_parser.add_argument("--site-rules", type=str)
+    arg_parser.add_argument("-o", "--output", type=str, help="Path of results json")
+    arg_parser.add_argument("-b", "--baseline", type=str, help="Path of baseline json")
+    arg_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    arg_parser.add_argument("--golden", type=str, default=str(GOLDEN_PATH))
+    arg_parser.add_argument(
+        "--update-golden",
+        action="store_true",
+        help="Save output hashes as golden, instead of checking them",
+    )
+    args = arg_parser.parse_args(args)
+
+    extra_settings = {}
+    if args.parser:
+        extra_settings["parser"] = args.parser
+    if args.markdown_backend:
+        extra_settings["markdown_backend"] = args.markdown_backend
+    if args.prestrip:
+        extra_settings["prestrip"] = True
+    if args.site_rules:
+        extra_settings["site_rules"] = args.site_rules
+    html_paths = None
+    if args.samples:
+        html_paths = sorted(Path(args.samples).glob("*.html"), key=lambda x: x.name)
+
+    benchmark = HTMLPurifierBenchmark(
+        html_paths=html_paths,
+        repeat=args.repeat,
+        warmup=args.warmup,
+        measure_memory=not args.no_memory,
+        extra_settings=extra_settings,
+    )
+    logger.note(
+        f"> Benchmarking {len(benchmark.html_paths)} samples "
+        f"x {len(benchmark.configs)} configs"
+    )
+    report = benchmark.run()
+
+    failed = False
+    if args.update_golden:
+        golden = load_json(args.golden)
+        for name, result in report["results"].items():
+            golden[name] = result["output_hashes"]
+        save_json(golden, args.golden)
+        logger.success(f"  > Saved golden outputs to: {args.golden}")
+    else:
+        mismatches = benchmark.check_golden(report, load_json(args.golden))
+        report["golden_mismatches"] = mismatches
+        for mismatch in mismatches:
+            logger.err(f"  × Output changed: {mismatch}")
+        failed = failed or bool(mismatches)
+
+    if args.baseline:
+        baseline = load_json(args.baseline)
+        if not baseline:
+            logger.warn(f"  × No baseline at: {args.baseline}")
+        regressions = benchmark.check_baseline(report, baseline, args.tolerance)
+        for regression in regressions:
+            logger.err(f"  × Regression: {regression}")
+        report["regressions"] = regressions
+        failed = failed or bool(regressions)
+
+    if args.output:
+        save_json(report, args.output)
+        logger.success(f"  > Saved results to: {args.output}")
+
+    if failed:
+        logger.err("× Benchmark failed")
+        return 1
+    logger.success("✓ Benchmark passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+    # python -m purehtml.benchmark -o bench.json
+    # python -m purehtml.benchmark -b bench.json
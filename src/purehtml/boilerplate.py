@@ -0,0 +1,170 @@
+import collections
+import hashlib
+import heapq
+import threading
+
+from bs4 import BeautifulSoup, Tag
+from bs4.element import PreformattedString
+from dataclasses import dataclass, field
+from typing import Optional
+
+# tags whose subtrees are fingerprinted, and dropped as a whole when repeated
+BLOCK_TAGS = [
+    *["header", "footer", "nav", "aside", "form", "div", "section"],
+    *["ul", "ol", "dl", "table", "p", "blockquote"],
+]
+# blocks with less text are never dropped, as short lines like "References"
+# repeat across pages of a site, but are part of the content
+MIN_BLOCK_CHARS = 32
+# blocks with more of the text of the page are never dropped,
+# so that near-duplicate pages are not emptied
+MAX_BLOCK_RATIO = 0.5
+# pages of a host to see before any block of it is dropped
+MIN_PAGES = 5
+MAX_HOSTS = 1000
+MAX_FINGERPRINTS_PER_HOST = 20000
+
+
+def get_block_fingerprints(root: Tag) -> dict:
+    # {id(tag): (fingerprint, text_chars)} of all tags, hashed bottom-up from tag names
+    # and collapsed strings, so each node is hashed once, and attrs are ignored,
+    # as ids and classes of the same block often vary across pages
+    fingerprints = {}
+    stack = [(root, False)]
+    while stack:
+        tag, visited = stack.pop()
+        if not visited:
+            stack.append((tag, True))
+            stack.extend(
+                (child, False) for child in tag.contents if isinstance(child, Tag)
+            )
+            continue
+        hasher = hashlib.blake2b(tag.name.encode("utf-8"), digest_size=8)
+        chars = 0
+        for child in tag.contents:
+            if isinstance(child, Tag):
+                fingerprint, child_chars = fingerprints[id(child)]
+                hasher.update(b"\x01" + fingerprint)
+                chars += child_chars
+            elif not isinstance(child, PreformattedString):
+                text = " ".join(child.split())
+                if text:
+                    hasher.update(b"\x00" + text.encode("utf-8", "replace"))
+                    chars += len(text)
+        fingerprints[id(tag)] = (hasher.digest(), chars)
+    return fingerprints
+
+
+@dataclass
+class HostBlocks:
+    # pages seen of a host, and number of pages each block fingerprint is on
+    pages: int = 0
+    counts: dict = field(default_factory=dict)
+
+
+class BoilerplateTable:
+    # Learns blocks repeated across pages of the same host, like navs, footers
+    # and sidebars missed by the remove rules, and drops them by fingerprint.
+    # A block is dropped from a page when it is on more than `threshold` of
+    # the pages of its host seen before, once at least `min_pages` are seen.
+    # Memory is bounded: least recently seen hosts are evicted over `max_hosts`,
+    # and when a host has over `max_fingerprints` blocks, the most frequent half
+    # is kept, and all counts are halved, so that blocks of old layouts fade.
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        min_pages: int = MIN_PAGES,
+        max_hosts: int = MAX_HOSTS,
+        max_fingerprints: int = MAX_FINGERPRINTS_PER_HOST,
+    ):
+        if not 0 < threshold < 1:
+            raise ValueError(f"Boilerplate threshold must be in (0, 1): {threshold}")
+        self.threshold = threshold
+        self.min_pages = min_pages
+        self.max_hosts = max_hosts
+        self.max_fingerprints = max_fingerprints
+        self.hosts = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def start_page(self, host: str = None) -> "BoilerplatePage":
+        return BoilerplatePage(self, host or "")
+
+    def get_min_count(self, host: str) -> Optional[float]:
+        # blocks on more pages than this are boilerplate, None if too few pages seen
+        host_blocks = self.hosts.get(host)
+        if host_blocks is None or host_blocks.pages < self.min_pages:
+            return None
+        return host_blocks.pages * self.threshold
+
+    def get_counts(self, host: str) -> dict:
+        host_blocks = self.hosts.get(host)
+        return host_blocks.counts if host_blocks else {}
+
+    def prune(self, host_blocks: HostBlocks):
+        kept = heapq.nlargest(
+            self.max_fingerprints // 2,
+            host_blocks.counts.items(),
+            key=lambda item: item[1],
+        )
+        # replaced instead of updated, as pages of other threads may read it
+        host_blocks.counts = {
+            fingerprint: count // 2 for fingerprint, count in kept if count >= 2
+        }
+        host_blocks.pages //= 2
+
+    def add_page(self, host: str, fingerprints: set):
+        with self.lock:
+            host_blocks = self.hosts.pop(host, None) or HostBlocks()
+            self.hosts[host] = host_blocks
+            while len(self.hosts) > self.max_hosts:
+                self.hosts.popitem(last=False)
+            host_blocks.pages += 1
+            counts = host_blocks.counts
+            for fingerprint in fingerprints:
+                counts[fingerprint] = counts.get(fingerprint, 0) + 1
+            if len(counts) > self.max_fingerprints:
+                self.prune(host_blocks)
+
+
+class BoilerplatePage:
+    # Blocks of one page, which are counted once when the page is finished,
+    # even if a page is purified in several prefixes.
+    # Blocks are dropped by counts of the pages seen before this one.
+    def __init__(self, table: BoilerplateTable, host: str):
+        self.table = table
+        self.host = host
+        self.counts = table.get_counts(host)
+        self.min_count = table.get_min_count(host)
+        self.fingerprints = set()
+
+    def filter_soup(self, soup: BeautifulSoup) -> int:
+        # return number of dropped blocks; blocks in dropped blocks are not counted,
+        # and nothing is dropped from pages seen before, as all their blocks repeat
+        block_fingerprints = get_block_fingerprints(soup)
+        page_fingerprint, page_chars = block_fingerprints[id(soup)]
+        self.fingerprints.add(page_fingerprint)
+        min_count = self.min_count
+        if page_fingerprint in self.counts:
+            min_count = None
+        max_chars = page_chars * MAX_BLOCK_RATIO
+        removed_count = 0
+        stack = [soup]
+        while stack:
+            tag = stack.pop()
+            if tag.name in BLOCK_TAGS:
+                fingerprint, chars = block_fingerprints[id(tag)]
+                if chars >= MIN_BLOCK_CHARS:
+                    self.fingerprints.add(fingerprint)
+                    if (
+                        min_count is not None
+                        and chars <= max_chars
+                        and self.counts.get(fingerprint, 0) > min_count
+                    ):
+                        tag.decompose()
+                        removed_count += 1
+                        continue
+            stack.extend(child for child in tag.contents if isinstance(child, Tag))
+        return removed_count
+
+    def finish(self):
+        self.table.add_page(self.host, self.fingerprints)
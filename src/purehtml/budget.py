@@ -0,0 +1,217 @@
+import math
+import re
+
+from bs4 import BeautifulSoup, Tag
+from bs4.element import NavigableString, PreformattedString
+from typing import Callable, Literal, Tuple
+
+# tags which are walked into, so that the cut can fall between their children
+CONTAINER_TAGS = [
+    *["html", "body", "main", "article", "header", "footer"],
+    *["div", "section", "details", "ul", "ol", "dl"],
+    *["thead", "tbody", "tfoot"],
+]
+# tags which are kept or dropped as a whole
+BLOCK_TAGS = [
+    *["title", "h1", "h2", "h3", "h4", "h5", "h6"],
+    *["p", "pre", "li", "dt", "dd", "table", "tr", "blockquote", "hr"],
+]
+# raw html chars to read at first per output char
+PREFIX_CHARS_PER_OUTPUT_CHAR = 16
+MIN_PREFIX_CHARS = 32 * 1024
+# bounds of the growth of the prefix, when its output is under the budget
+MIN_PREFIX_GROWTH = 2
+MAX_PREFIX_GROWTH = 4
+# a prefix over this ratio of the page is extended to the whole page
+FULL_PAGE_RATIO = 0.75
+# rough chars per token, to size the prefix for `max_output_tokens`
+CHARS_PER_TOKEN = 4
+TOKEN_RE = re.compile(r"[a-zA-Z]+|\d|\S")
+CODE_FENCE = "```"
+
+
+def count_tokens(text: str) -> int:
+    # rough count without a tokenizer: one token per latin word,
+    # and one per digit or other non-space char (e.g. CJK chars and punctuation)
+    return len(TOKEN_RE.findall(text))
+
+
+class OutputBudget:
+    # Max chars and/or tokens of the output.
+    # It holds no state of a call, so purifiers sharing it stay thread-safe.
+    # - token_counter: callable from text to number of tokens, `count_tokens` if None;
+    #   it must be a module-level function to be sent to process pools
+    def __init__(
+        self,
+        max_chars: int = None,
+        max_tokens: int = None,
+        token_counter: Callable[[str], int] = None,
+    ):
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter or count_tokens
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_chars or self.max_tokens)
+
+    def get_counter_name(self) -> str:
+        counter = self.token_counter
+        return f"{counter.__module__}.{getattr(counter, '__qualname__', counter)}"
+
+    def get_prefix_chars(self) -> int:
+        output_chars = min(
+            self.max_chars or math.inf,
+            (self.max_tokens or math.inf) * CHARS_PER_TOKEN,
+        )
+        return int(max(MIN_PREFIX_CHARS, output_chars * PREFIX_CHARS_PER_OUTPUT_CHAR))
+
+    def get_prefix_growth(self, output: str) -> float:
+        # grow by the ratio of the budget to the output of the last prefix,
+        # so pages with large heads or much boilerplate are not purified many times
+        chars, tokens = self.measure(output)
+        ratios = []
+        if self.max_chars:
+            ratios.append(self.max_chars / max(chars, 1))
+        if self.max_tokens:
+            ratios.append(self.max_tokens / max(tokens, 1))
+        growth = min(ratios) * 1.5
+        return min(max(growth, MIN_PREFIX_GROWTH), MAX_PREFIX_GROWTH)
+
+    def measure(self, text: str) -> Tuple[int, int]:
+        tokens = self.token_counter(text) if self.max_tokens else 0
+        return len(text), tokens
+
+    def is_over(self, chars: int, tokens: int) -> bool:
+        return bool(
+            (self.max_chars and chars > self.max_chars)
+            or (self.max_tokens and tokens > self.max_tokens)
+        )
+
+    def get_node_text(
+        self, node, output_format: Literal["markdown", "html"] = "markdown"
+    ) -> str:
+        if output_format == "html":
+            # strings as serialized, e.g. with "<!DOCTYPE" around doctypes and escaped "&"
+            if isinstance(node, NavigableString):
+                return node.output_ready()
+            return str(node)
+        if isinstance(node, PreformattedString):
+            return ""
+        if isinstance(node, NavigableString):
+            return " ".join(node.split())
+        # spaces are collapsed in markdown, so they are not counted
+        return " ".join(node.get_text().split())
+
+    def get_wrapper_text(
+        self, tag: Tag, output_format: Literal["markdown", "html"] = "markdown"
+    ) -> str:
+        # start and end tags, which are kept around the kept children
+        if output_format != "html":
+            return ""
+        attrs_str = "".join(
+            f' {key}="{" ".join(value) if isinstance(value, list) else value}"'
+            for key, value in tag.attrs.items()
+        )
+        return f"<{tag.name}{attrs_str}></{tag.name}>"
+
+    def find_cut_node(
+        self, root: Tag, output_format: Literal["markdown", "html"] = "markdown"
+    ):
+        # return the first block which does not fit, or None if all fit;
+        # inline nodes between blocks are one run, which is never split,
+        # and a node larger than the whole budget (e.g. a layout table) is walked into
+        chars, tokens = 0, 0
+        run_start = None
+        stack = [iter(root.contents)]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                run_start = None
+                continue
+            is_tag = isinstance(node, Tag)
+            is_container = is_tag and node.name in CONTAINER_TAGS
+            if not is_container:
+                node_chars, node_tokens = self.measure(
+                    self.get_node_text(node, output_format)
+                )
+                is_container = is_tag and self.is_over(node_chars, node_tokens)
+            if is_container:
+                run_start = None
+                wrapper_chars, wrapper_tokens = self.measure(
+                    self.get_wrapper_text(node, output_format)
+                )
+                chars += wrapper_chars
+                tokens += wrapper_tokens
+                stack.append(iter(node.contents))
+                continue
+            if is_tag and node.name in BLOCK_TAGS:
+                run_start = None
+            elif run_start is None:
+                run_start = node
+            chars += node_chars
+            tokens += node_tokens
+            if self.is_over(chars, tokens):
+                return run_start or node
+        return None
+
+    def cut_after(self, node, root: Tag):
+        # drop the node and all nodes after it, then the containers left empty
+        following = [node, *node.next_siblings]
+        parent = node.parent
+        ancestor = parent
+        while ancestor is not None and ancestor is not root:
+            following.extend(ancestor.next_siblings)
+            ancestor = ancestor.parent
+        for element in following:
+            element.extract()
+        while parent is not None and parent is not root:
+            if parent.get_text().strip():
+                break
+            grandparent = parent.parent
+            parent.extract()
+            parent = grandparent
+
+    def truncate_soup(
+        self,
+        soup: BeautifulSoup,
+        output_format: Literal["markdown", "html"] = "markdown",
+    ) -> bool:
+        # return True if blocks over the budget were dropped
+        cut_node = self.find_cut_node(soup, output_format)
+        if cut_node is None:
+            return False
+        self.cut_after(cut_node, soup)
+        return True
+
+    def iter_text_blocks(self, text: str):
+        # blocks split by blank lines, without splitting code fences
+        block = []
+        fence_count = 0
+        for part in text.split("\n\n"):
+            block.append(part)
+            fence_count += part.count(CODE_FENCE)
+            if fence_count % 2 == 0:
+                yield "\n\n".join(block)
+                block = []
+        if block:
+            yield "\n\n".join(block)
+
+    def cut_text(self, text: str) -> Tuple[str, bool]:
+        # keep whole blocks of markdown text until the budget is hit,
+        # return (text, is_cut)
+        chars, tokens = self.measure(text)
+        if not self.is_over(chars, tokens):
+            return text, False
+        blocks = []
+        chars, tokens = 0, 0
+        for block in self.iter_text_blocks(text):
+            block_chars, block_tokens = self.measure(block)
+            # blocks are joined by 2 newlines
+            chars += block_chars + (2 if blocks else 0)
+            tokens += block_tokens
+            if self.is_over(chars, tokens):
+                break
+            blocks.append(block)
+        return "\n\n".join(blocks), True
@@ -0,0 +1,118 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from pathlib import Path
+from typing import Optional, Union
+
+from . import constants
+
+# bump when purification code changes its output for the same rules and settings
+CACHE_VERSION = 1
+
+
+def get_rules_fingerprint() -> str:
+    rules = {
+        name: value
+        for name, value in sorted(vars(constants).items())
+        if name.isupper() and isinstance(value, (list, str))
+    }
+    rules_str = json.dumps([CACHE_VERSION, rules], sort_keys=True)
+    return hashlib.blake2b(rules_str.encode("utf-8"), digest_size=8).hexdigest()
+
+
+RULES_FINGERPRINT = get_rules_fingerprint()
+
+
+class PurifyCache:
+    # Content-addressed cache of purified outputs.
+    # Keys are hashes of the input HTML, the purifier settings and the rule set.
+    # The memory tier is an LRU bounded by the total size of cached outputs,
+    # and the optional disk tier is a sqlite file that processes can share.
+    def __init__(
+        self,
+        max_memory_bytes: int = 256 * 1024 * 1024,
+        path: Union[str, Path] = None,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.path = Path(path) if path else None
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        self.conn_pid = None
+
+    def make_key(self, html: Union[str, bytes], settings: dict) -> str:
+        if isinstance(html, str):
+            html = html.encode("utf-8", errors="surrogatepass")
+        settings_str = json.dumps(settings, sort_keys=True)
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(f"{RULES_FINGERPRINT}:{settings_str}:".encode("utf-8"))
+        hasher.update(html)
+        return hasher.hexdigest()
+
+    def get_conn(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        # connections are not shared with forked worker processes
+        if self.conn is None or self.conn_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outputs (key TEXT PRIMARY KEY, output TEXT)"
+            )
+            conn.commit()
+            self.conn = conn
+            self.conn_pid = os.getpid()
+        return self.conn
+
+    def set_memory(self, key: str, output: str):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        if len(output) > self.max_memory_bytes:
+            return
+        self.memory[key] = output
+        self.memory_bytes += len(output)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            conn = self.get_conn()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT output FROM outputs WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.set_memory(key, row[0])
+            return row[0]
+
+    def set(self, key: str, output: str):
+        with self.lock:
+            self.set_memory(key, output)
+            conn = self.get_conn()
+            if conn is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO outputs (key, output) VALUES (?, ?)",
+                    (key, output),
+                )
+                conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            conn = self.get_conn()
+            if conn is not None:
+                conn.execute("DELETE FROM outputs")
+                conn.commit()
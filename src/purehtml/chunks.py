@@ -0,0 +1,188 @@
+from bs4 import BeautifulSoup, Tag
+from bs4.element import PreformattedString
+from typing import Callable, Iterable, Iterator, Literal, Tuple
+
+from .html2md import StreamMarkdownConverter
+
+DEFAULT_CHUNK_SIZE = 1000
+# tags which are walked into, so that chunks can break between their children
+CONTAINER_TAGS = [
+    *["html", "body", "main", "article", "header", "footer"],
+    *["div", "section", "details"],
+]
+# tags whose start and end also end the current chunk
+SECTION_TAGS = ["section", "details", "article"]
+HEADING_LEVELS = {f"h{level}": level for level in range(1, 7)}
+LIST_TAGS = ["ul", "ol"]
+TABLE_TAGS = ["table"]
+# tags which are kept in one chunk, except lists and tables over the chunk size
+BLOCK_TAGS = [
+    *["title", "p", "pre", "blockquote", "hr", "dl"],
+    *LIST_TAGS,
+    *TABLE_TAGS,
+]
+CHUNK_SEPARATORS = {"markdown": "\n\n", "html": "\n"}
+
+
+def join_chunks(
+    chunks: Iterable[dict], output_format: Literal["markdown", "html"] = "markdown"
+) -> str:
+    # the output which `start` and `end` of chunks point into
+    return CHUNK_SEPARATORS[output_format].join(chunk["text"] for chunk in chunks)
+
+
+class HTMLChunker:
+    # Splits a purified tree into chunks of about `chunk_size` chars in one walk,
+    # rendering each block once, without serializing the whole output.
+    # Chunks end before headings and at the start and end of sections,
+    # and blocks are never split, except lists and tables over `chunk_size`,
+    # which are split between items and rows; each part of a table repeats its header.
+    # Each chunk is `{"text", "heading_path", "start", "end"}`,
+    # where `start` and `end` are offsets in `join_chunks()` of all chunks.
+    # Markdown is rendered like `markdown_backend="stream"`.
+    # It holds the state of a walk, so create one per document.
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        output_format: Literal["markdown", "html"] = "markdown",
+        parser: str = "html.parser",
+    ):
+        self.chunk_size = chunk_size
+        self.output_format = output_format
+        self.separator = CHUNK_SEPARATORS[output_format]
+        self.md_converter = StreamMarkdownConverter(parser=parser)
+
+    def iter_blocks(self, root: Tag) -> Iterator[Tuple[str, object]]:
+        # yield (kind, node) in document order, where kind is:
+        # "break" at the start and end of sections, "heading", "block",
+        # or "run" for the list of inline nodes between blocks
+        run = []
+        stack = [(None, iter(root.contents))]
+        while stack:
+            node = next(stack[-1][1], None)
+            if node is None:
+                container, _ = stack.pop()
+                if run:
+                    yield "run", run
+                    run = []
+                if container is not None and container.name in SECTION_TAGS:
+                    yield "break", container
+                continue
+            if not isinstance(node, Tag):
+                run.append(node)
+                continue
+            if node.name in CONTAINER_TAGS:
+                if run:
+                    yield "run", run
+                    run = []
+                if node.name in SECTION_TAGS:
+                    yield "break", node
+                stack.append((node, iter(node.contents)))
+            elif node.name in HEADING_LEVELS or node.name in BLOCK_TAGS:
+                if run:
+                    yield "run", run
+                    run = []
+                yield ("heading" if node.name in HEADING_LEVELS else "block"), node
+            else:
+                run.append(node)
+
+    def render_nodes(self, nodes: list) -> str:
+        # doctype, comments and other special strings are dropped
+        nodes = [node for node in nodes if not isinstance(node, PreformattedString)]
+        if self.output_format == "html":
+            return "".join(str(node) for node in nodes).strip()
+        out = []
+        for node in nodes:
+            self.md_converter.write_node(node, out)
+        return self.md_converter.remove_extra_lines("".join(out)).strip()
+
+    def group_parts(self, parts: list, render_group: Callable[[list], str]):
+        # yield rendered groups of parts, each under `chunk_size` if possible
+        group = []
+        for part in parts:
+            if group and len(render_group(group + [part])) > self.chunk_size:
+                yield render_group(group)
+                group = []
+            group.append(part)
+        if group:
+            yield render_group(group)
+
+    def iter_list_parts(self, element: Tag) -> Iterator[str]:
+        if self.output_format == "html":
+            items = [str(child) for child in element.children if isinstance(child, Tag)]
+            wrap = lambda group: f"<{element.name}>{''.join(group)}</{element.name}>"
+            yield from self.group_parts(items, wrap)
+        else:
+            items = self.md_converter.render_list_items(element)
+            yield from self.group_parts(items, lambda group: "\n".join(group).strip())
+
+    def iter_table_parts(self, element: Tag) -> Iterator[str]:
+        if self.output_format == "html":
+            rows = [str(tr) for tr in self.md_converter.find_table_rows(element)]
+            render_rows = lambda group: f"<table>{''.join(group)}</table>"
+        else:
+            rows = self.md_converter.get_table_rows(element)
+            render_rows = self.md_converter.render_table_rows
+        if len(rows) < 2:
+            yield render_rows(rows) if rows else ""
+            return
+        header, rows = rows[0], rows[1:]
+        yield from self.group_parts(rows, lambda group: render_rows([header, *group]))
+
+    def iter_block_texts(self, kind: str, node) -> Iterator[str]:
+        text = self.render_nodes(node if kind == "run" else [node])
+        if len(text) <= self.chunk_size or kind == "run":
+            yield text
+        elif node.name in LIST_TAGS:
+            yield from self.iter_list_parts(node)
+        elif node.name in TABLE_TAGS:
+            yield from self.iter_table_parts(node)
+        else:
+            yield text
+
+    def make_chunk(self, texts: list[str], heading_path: list[str], start: int):
+        text = self.separator.join(texts)
+        return {
+            "text": text,
+            "heading_path": heading_path,
+            "start": start,
+            "end": start + len(text),
+        }
+
+    def iter_chunks(self, soup: BeautifulSoup) -> Iterator[dict]:
+        heading_path = []  # [(level, text)]
+        texts = []
+        chunk_path = []
+        chunk_chars = 0
+        start = 0
+        for kind, node in self.iter_blocks(soup):
+            if kind in ("break", "heading") and texts:
+                chunk = self.make_chunk(texts, chunk_path, start)
+                start = chunk["end"] + len(self.separator)
+                texts, chunk_chars = [], 0
+                yield chunk
+            if kind == "break":
+                continue
+            if kind == "heading":
+                level = HEADING_LEVELS[node.name]
+                while heading_path and heading_path[-1][0] >= level:
+                    heading_path.pop()
+                heading_path.append((level, " ".join(node.get_text().split())))
+            for text in self.iter_block_texts(kind, node):
+                if not text:
+                    continue
+                if texts and (
+                    chunk_chars + len(self.separator) + len(text) > self.chunk_size
+                ):
+                    chunk = self.make_chunk(texts, chunk_path, start)
+                    start = chunk["end"] + len(self.separator)
+                    texts, chunk_chars = [], 0
+                    yield chunk
+                if not texts:
+                    chunk_path = [heading for _, heading in heading_path]
+                    chunk_chars = len(text)
+                else:
+                    chunk_chars += len(self.separator) + len(text)
+                texts.append(text)
+        if texts:
+            yield self.make_chunk(texts, chunk_path, start)
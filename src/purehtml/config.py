@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from typing import FrozenSet
+
+from .constants import (
+    ENV_TAGS,
+    GROUP_TAGS,
+    FORMAT_TAGS,
+    PROTECT_TAGS,
+    MATH_TAGS,
+)
+
+
+@dataclass(frozen=True)
+class TagConfig:
+    # Immutable tag sets, built once per purifier.
+    # The module-level lists in `constants` are never mutated,
+    # so the config is safe to share across threads and calls.
+    keep_tags: FrozenSet[str]
+    protect_tags: FrozenSet[str]
+    math_tags: FrozenSet[str]
+
+    @classmethod
+    def from_options(
+        cls, keep_format_tags: bool = True, keep_group_tags: bool = True
+    ) -> "TagConfig":
+        keep_tags = [*ENV_TAGS]
+        if keep_group_tags:
+            keep_tags.extend(GROUP_TAGS)
+        if keep_format_tags:
+            keep_tags.extend(FORMAT_TAGS)
+        return cls(
+            keep_tags=frozenset(keep_tags),
+            protect_tags=frozenset(PROTECT_TAGS),
+            math_tags=frozenset(MATH_TAGS),
+        )
@@ -0,0 +1,145 @@
+import codecs
+import hashlib
+import mmap
+import os
+import re
+
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+# bytes to look into for <meta charset> and http-equiv hints
+SNIFF_BYTES = 4096
+# files larger than this are decoded straight from a memory map
+MMAP_MIN_BYTES = 1024 * 1024
+# max ratio of undecodable chars for which utf-8 is still preferred over the fallback
+UTF8_ERROR_RATIO = 0.001
+FALLBACK_ENCODING = "cp1252"
+
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# labels which browsers decode with a superset encoding (WHATWG Encoding Standard)
+ENCODING_ALIASES = {
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+    "x-gbk": "gb18030",
+    "shift_jis": "cp932",
+    "shift-jis": "cp932",
+    "sjis": "cp932",
+    "x-sjis": "cp932",
+    "windows-31j": "cp932",
+    "euc-kr": "cp949",
+    "ks_c_5601-1987": "cp949",
+    "big5": "big5hkscs",
+    "iso-8859-1": "cp1252",
+    "latin1": "cp1252",
+    "latin-1": "cp1252",
+    "us-ascii": "cp1252",
+    "ascii": "cp1252",
+}
+
+META_CHARSET_RE = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_.:\-]+)""", flags=re.IGNORECASE
+)
+CONTENT_TYPE_CHARSET_RE = re.compile(
+    r"""charset\s*=\s*["']?\s*([a-zA-Z0-9_.:\-]+)""", flags=re.IGNORECASE
+)
+
+
+def normalize_encoding(label: Optional[str]) -> Optional[str]:
+    if not label:
+        return None
+    label = label.strip().lower()
+    label = ENCODING_ALIASES.get(label, label)
+    try:
+        return codecs.lookup(label).name
+    except LookupError:
+        return None
+
+
+def sniff_encoding(
+    data: Union[bytes, memoryview], content_type: str = None
+) -> Optional[str]:
+    # BOM > HTTP-style Content-Type hint > <meta charset> or http-equiv in the head
+    head = bytes(data[:SNIFF_BYTES])
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    if content_type:
+        match = CONTENT_TYPE_CHARSET_RE.search(content_type)
+        if match and normalize_encoding(match.group(1)):
+            return normalize_encoding(match.group(1))
+    match = META_CHARSET_RE.search(head)
+    if match:
+        encoding = normalize_encoding(match.group(1).decode("ascii", "ignore"))
+        # a page which is read as bytes can not really be utf-16
+        if encoding and not encoding.startswith("utf-16"):
+            return encoding
+    return None
+
+
+def normalize_newlines(html_str: str) -> str:
+    if "\r" in html_str:
+        html_str = html_str.replace("\r\n", "\n").replace("\r", "\n")
+    return html_str
+
+
+def decode_html_bytes(
+    data: Union[bytes, memoryview], encoding: str = None, content_type: str = None
+) -> Tuple[str, str]:
+    # return (html_str, encoding)
+    encoding = normalize_encoding(encoding) or sniff_encoding(data, content_type)
+    candidates = [encoding] if encoding else []
+    if "utf-8" not in candidates:
+        candidates.append("utf-8")
+    for candidate in candidates:
+        try:
+            return normalize_newlines(str(data, candidate)), candidate
+        except (UnicodeDecodeError, LookupError):
+            pass
+
+    if encoding:
+        # a declared encoding is trusted, with few broken bytes
+        return normalize_newlines(str(data, encoding, "replace")), encoding
+
+    # undeclared: mostly utf-8 with some broken bytes, or a legacy single-byte page
+    html_str = str(data, "utf-8", "replace")
+    if html_str.count("\ufffd") <= len(html_str) * UTF8_ERROR_RATIO:
+        return normalize_newlines(str(data, "utf-8", "ignore")), "utf-8"
+    return (
+        normalize_newlines(str(data, FALLBACK_ENCODING, "replace")),
+        FALLBACK_ENCODING,
+    )
+
+
+def get_input_state(file_stat: os.stat_result, data) -> dict:
+    # size, mtime and hash of the bytes which were read, for incremental manifests
+    return {
+        "size": len(data),
+        "mtime_ns": file_stat.st_mtime_ns,
+        "hash": hashlib.blake2b(data, digest_size=16).hexdigest(),
+    }
+
+
+def read_html_bytes_file(
+    html_path: Union[Path, str], encoding: str = None, input_state: dict = None
+) -> Tuple[str, str]:
+    # large files are decoded straight from a memory map, without copying into bytes;
+    # pass a dict as `input_state` to fill it with `get_input_state()` of the bytes
+    with open(html_path, "rb") as rf:
+        file_stat = os.fstat(rf.fileno())
+        if file_stat.st_size < MMAP_MIN_BYTES:
+            data = rf.read()
+            if input_state is not None:
+                input_state.update(get_input_state(file_stat, data))
+            return decode_html_bytes(data, encoding=encoding)
+        with mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                if input_state is not None:
+                    input_state.update(get_input_state(file_stat, view))
+                return decode_html_bytes(view, encoding=encoding)
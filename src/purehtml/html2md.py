@@ -2,7 +2,13 @@ import html
 import re
 import warnings
 
-from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning
+from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning, Tag
+from bs4.element import NavigableString, PreformattedString
+from typing import Callable, Literal, Union
+
+from .budget import OutputBudget
+from .parsers import FRAGMENT_PARSER, ParserType, parse_html, resolve_parser
+from .traverse import find_all_in_tags, find_all_contain_tags
 
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
 
@@ -52,10 +58,16 @@ ESCAPED_CHAR_MAP = {
     "_": "\_",
 }
 
+# tags only used by StreamMarkdownConverter
+SKIP_TAGS = ["script", "style", "template", "noscript"]
+BLOCK_GROUP_TAGS = ["div", "section", "details", "article", "main", "header"]
+INLINE_HTML_TAGS = ["sub", "sup", "u", "mark", "ins"]
+LATEX_SEGMENT_RE = re.compile(r"(\$\$.*?\$\$|\$[^$]*\$)", flags=re.DOTALL)
+
 
 class HTMLToMarkdownConverter:
-    def __init__(self):
-        pass
+    def __init__(self, parser: str = "html.parser"):
+        self.parser = parser
 
     def is_protected(self, element):
         return self.is_in_tags(element, PROTECTED_TAGS)
@@ -68,21 +80,13 @@ class HTMLToMarkdownConverter:
                 return True
         return False
 
-    def is_contain_tags(self, element, tags):
-        if element.name in tags:
-            return True
-        for element in element.descendants:
-            if element.name in tags:
-                return True
-        return False
-
-    def is_related_tags(self, element, tags):
-        return self.is_in_tags(element, tags) or self.is_contain_tags(element, tags)
-
     def check_protected_tag(func):
-        def wrapper(self, element, *args, **kwargs):
+        # `is_protected` can be passed in when it is already known from a traversal
+        def wrapper(self, element, *args, is_protected=None, **kwargs):
             try:
-                if self.is_protected(element):
+                if is_protected is None:
+                    is_protected = self.is_protected(element)
+                if is_protected:
                     return
                 return func(self, element, *args, **kwargs)
             except Exception as e:
@@ -103,11 +107,17 @@ class HTMLToMarkdownConverter:
             element.string.replace_with(new_string)
 
     def escape_soup(self, soup):
-        for element in soup.find_all(True):
-            if not self.is_related_tags(element, CODE_TAGS):
+        elements_in_code = find_all_in_tags(soup, CODE_TAGS)
+        contain_code_ids = find_all_contain_tags(
+            soup, CODE_TAGS, [element for element, _ in elements_in_code]
+        )
+        for element, is_in_code in elements_in_code:
+            if not is_in_code and id(element) not in contain_code_ids:
                 self.escape_element(element)
 
     def remove_empty_elements(self, soup):
+        # only top-level elements are checked, so their disjoint subtrees
+        # are walked once in total
         for element in soup.contents:
             if (
                 not self.is_in_tags(element, CODE_TAGS + MATH_TAGS + TABLE_TAGS)
@@ -141,7 +151,7 @@ class HTMLToMarkdownConverter:
         new_string = re.sub("\n+", " ", new_string)
         new_string = new_string.strip()
         new_string = f"{mark} {new_string}"
-        new_element = BeautifulSoup(new_string, "html.parser")
+        new_element = BeautifulSoup(new_string, FRAGMENT_PARSER)
         element.replace_with(new_element)
 
     def convert_li_element(self, li, level=-1, idx=0):
@@ -156,7 +166,7 @@ class HTMLToMarkdownConverter:
         indent_str = "  " * level
         new_string = f"{indent_str}{mark} {new_string}"
         new_string = re.sub(rf"{mark}\s*•", f"{mark}", new_string)
-        new_li = BeautifulSoup(new_string, "html.parser")
+        new_li = BeautifulSoup(new_string, FRAGMENT_PARSER)
         return new_li
 
     @check_protected_tag
@@ -180,7 +190,7 @@ class HTMLToMarkdownConverter:
         trailing_spaces = " " * (len(new_string) - len(new_string.rstrip()))
         new_string = new_string.strip()
         new_string = f"{leading_spaces}{mark}{new_string}{mark}{trailing_spaces}"
-        new_element = BeautifulSoup(new_string, "html.parser")
+        new_element = BeautifulSoup(new_string, FRAGMENT_PARSER)
         element.replace_with(new_element)
 
     @check_protected_tag
@@ -192,7 +202,7 @@ class HTMLToMarkdownConverter:
         marked_lines = [f"{mark} {line}" for line in lines]
         new_string = "\n".join(marked_lines)
         new_string = f"\n{new_string}\n"
-        new_element = BeautifulSoup(new_string, "html.parser")
+        new_element = BeautifulSoup(new_string, FRAGMENT_PARSER)
         element.replace_with(new_element)
 
     @check_protected_tag
@@ -200,8 +210,10 @@ class HTMLToMarkdownConverter:
         element.insert_before("\n")
         element.insert_after("\n")
 
-    def convert_code_element(self, element):
-        if element.parent.name == "pre":
+    def convert_code_element(self, element, is_in_pre: bool = None):
+        if is_in_pre is None:
+            is_in_pre = element.parent.name == "pre"
+        if is_in_pre:
             element.unwrap()
         else:
             mark = "`"
@@ -215,7 +227,7 @@ class HTMLToMarkdownConverter:
         new_string = self.unwrap_tag(new_string, element.name)
         new_string = new_string.strip()
         new_string = f"\n{mark}\n{new_string}\n{mark}\n"
-        new_element = BeautifulSoup(new_string, "html.parser")
+        new_element = BeautifulSoup(new_string, FRAGMENT_PARSER)
         element.replace_with(new_element)
 
     def convert_dd_element(self, dd):
@@ -224,7 +236,7 @@ class HTMLToMarkdownConverter:
             new_string = new_string.replace(tag, f"{tag}\n\n")
         for tag in ["</dt>", "</dd>"]:
             new_string = re.sub(rf"\s*{tag}", f"\n{tag}", new_string)
-        new_dd = BeautifulSoup(new_string, "html.parser")
+        new_dd = BeautifulSoup(new_string, FRAGMENT_PARSER)
         return new_dd
 
     @check_protected_tag
@@ -244,36 +256,336 @@ class HTMLToMarkdownConverter:
         s = self.remove_extra_lines(s)
         return s
 
-    def convert(self, html_str):
-        soup = BeautifulSoup(html_str, "html.parser")
+    def convert(self, html_str: Union[str, BeautifulSoup]):
+        # a parsed soup (e.g. from HTMLPurifier) is converted in place without re-parsing
+        if isinstance(html_str, BeautifulSoup):
+            soup = html_str
+        else:
+            soup = parse_html(html_str, self.parser)
         self.remove_empty_elements(soup)
         self.escape_soup(soup)
 
-        for element in soup.find_all(UNWRAP_TAGS):
-            self.convert_unwrap_element(element)
-        for element in soup.find_all(GROUP_TAGS):
-            self.convert_group_element(element)
-        for element in soup.find_all(BEGIN_MARK_MAP.keys()):
-            self.convert_begin_element(element)
-        for element in soup.find_all(LIST_TAGS):
-            self.convert_list_element(element)
-        for element in soup.find_all(PAIRED_MARK_MAP.keys()):
-            self.convert_paired_element(element)
-        for element in soup.find_all(PER_LINE_MARK_MAP.keys()):
-            self.convert_per_line_element(element)
-        for element in soup.find_all(NEW_LINE_TAGS):
-            self.convert_new_line_element(element)
-        for element in soup.find_all("code"):
-            self.convert_code_element(element)
-        for element in soup.find_all("pre"):
-            self.convert_pre_element(element)
-        for element in soup.find_all(DEF_TAGS):
-            self.convert_def_element(element)
+        for tags, convert_func in [
+            (UNWRAP_TAGS, self.convert_unwrap_element),
+            (GROUP_TAGS, self.convert_group_element),
+            (BEGIN_MARK_MAP.keys(), self.convert_begin_element),
+            (LIST_TAGS, self.convert_list_element),
+            (PAIRED_MARK_MAP.keys(), self.convert_paired_element),
+            (PER_LINE_MARK_MAP.keys(), self.convert_per_line_element),
+            (NEW_LINE_TAGS, self.convert_new_line_element),
+        ]:
+            for element, is_protected in find_all_in_tags(
+                soup, PROTECTED_TAGS, names=tags
+            ):
+                convert_func(element, is_protected=is_protected)
+        # code in pre is unwrapped before the pre blocks are converted
+        code_elements = find_all_in_tags(soup, ["pre"], names=CODE_TAGS)
+        for element, is_in_pre in code_elements:
+            if element.name == "code":
+                self.convert_code_element(element, is_in_pre=is_in_pre)
+        for element, _ in code_elements:
+            if element.name == "pre":
+                self.convert_pre_element(element)
+        for element, is_protected in find_all_in_tags(
+            soup, PROTECTED_TAGS, names=DEF_TAGS
+        ):
+            self.convert_def_element(element, is_protected=is_protected)
 
         md_str = self.soup2str(soup)
         return md_str
 
 
-def html2md(html_str):
-    converter = HTMLToMarkdownConverter()
-    return converter.convert(html_str)
+class MarkdownBlock(str):
+    # pre-rendered lines (e.g. nested lists and code blocks)
+    # which must not be joined into one line
+    pass
+
+
+class StreamMarkdownConverter:
+    # Walk the tree once, and write markdown to an output buffer as it goes.
+    # Unlike HTMLToMarkdownConverter, it never serializes or re-parses elements.
+    def __init__(self, parser: str = "html.parser"):
+        self.parser = parser
+        self.list_level = -1
+        self.element_writers = {
+            **{tag: self.write_skip_element for tag in SKIP_TAGS},
+            **{tag: self.write_heading_element for tag in BEGIN_MARK_MAP},
+            **{tag: self.write_paired_element for tag in PAIRED_MARK_MAP},
+            **{tag: self.write_group_element for tag in BLOCK_GROUP_TAGS},
+            **{tag: self.write_list_element for tag in LIST_TAGS},
+            **{tag: self.write_inline_html_element for tag in INLINE_HTML_TAGS},
+            "p": self.write_para_element,
+            "blockquote": self.write_blockquote_element,
+            "pre": self.write_pre_element,
+            "code": self.write_code_element,
+            "dl": self.write_def_element,
+            "table": self.write_table_element,
+            "math": self.write_math_element,
+            "a": self.write_link_element,
+            "img": self.write_img_element,
+            "br": self.write_br_element,
+            "hr": self.write_hr_element,
+        }
+
+    def escape_text(self, text):
+        # latex from math_style="latex*" is kept as is
+        segments = LATEX_SEGMENT_RE.split(text)
+        for idx in range(0, len(segments), 2):
+            for char, replaced in ESCAPED_CHAR_MAP.items():
+                segments[idx] = segments[idx].replace(char, replaced)
+        return "".join(segments)
+
+    def collapse_spaces(self, text):
+        return re.sub(r"\s+", " ", text).strip()
+
+    def render_children(self, element) -> str:
+        out = []
+        self.write_children(element, out)
+        return "".join(out)
+
+    def write_children(self, element, out: list):
+        for child in element.children:
+            self.write_node(child, out)
+
+    def write_node(self, node, out: list):
+        if isinstance(node, NavigableString):
+            # skip comments, doctype, cdata, processing instructions, ...
+            if not isinstance(node, PreformattedString):
+                out.append(self.escape_text(str(node)))
+        elif isinstance(node, Tag):
+            writer = self.element_writers.get(node.name, self.write_children)
+            writer(node, out)
+
+    def write_skip_element(self, element, out: list):
+        pass
+
+    def write_group_element(self, element, out: list):
+        out.append("\n")
+        self.write_children(element, out)
+        out.append("\n")
+
+    def write_para_element(self, element, out: list):
+        out.append("\n\n")
+        self.write_children(element, out)
+        out.append("\n\n")
+
+    def write_heading_element(self, element, out: list):
+        mark = BEGIN_MARK_MAP[element.name]
+        text = self.collapse_spaces(self.render_children(element))
+        out.append(f"\n\n{mark} {text}\n\n")
+
+    def write_paired_element(self, element, out: list):
+        mark = PAIRED_MARK_MAP[element.name]
+        text = self.render_children(element)
+        stripped = text.strip()
+        if not stripped:
+            out.append(text)
+            return
+        leading_spaces = " " * (len(text) - len(text.lstrip()))
+        trailing_spaces = " " * (len(text) - len(text.rstrip()))
+        out.append(f"{leading_spaces}{mark}{stripped}{mark}{trailing_spaces}")
+
+    def write_inline_html_element(self, element, out: list):
+        out.append(f"<{element.name}>")
+        self.write_children(element, out)
+        out.append(f"</{element.name}>")
+
+    def write_blockquote_element(self, element, out: list):
+        mark = PER_LINE_MARK_MAP[element.name]
+        text = self.remove_extra_lines(self.render_children(element)).strip()
+        lines = [f"{mark} {line}".rstrip() for line in text.split("\n")]
+        out.append("\n\n" + "\n".join(lines) + "\n\n")
+
+    def write_pre_element(self, element, out: list):
+        mark = ENV_MARK_MAP[element.name]
+        text = element.get_text().strip("\n").rstrip()
+        out.append(MarkdownBlock(f"\n\n{mark}\n{text}\n{mark}\n\n"))
+
+    def write_code_element(self, element, out: list):
+        text = element.get_text()
+        mark = "``" if "`" in text else "`"
+        out.append(f"{mark}{text}{mark}")
+
+    def write_math_element(self, element, out: list):
+        # math_style="html" keeps MathML, which markdown renders as inline HTML
+        out.append(str(element))
+
+    def write_link_element(self, element, out: list):
+        href = element.get("href")
+        if href:
+            text = self.collapse_spaces(self.render_children(element))
+            out.append(f"[{text}]({href})")
+        else:
+            self.write_children(element, out)
+
+    def write_img_element(self, element, out: list):
+        src = element.get("src")
+        if src:
+            alt = element.get("alt") or ""
+            out.append(f"![{alt}]({src})")
+
+    def write_br_element(self, element, out: list):
+        out.append("\n")
+
+    def write_hr_element(self, element, out: list):
+        out.append("\n\n---\n\n")
+
+    def write_list_element(self, element, out: list):
+        lines = self.render_list_items(element)
+        out.append(MarkdownBlock("\n" + "\n".join(lines) + "\n"))
+
+    def render_list_items(self, element) -> list[str]:
+        # rendered lines of each item, nested lists are in the lines of their item
+        self.list_level += 1
+        lines = []
+        idx = 0
+        for li in element.children:
+            if not isinstance(li, Tag):
+                continue
+            if li.name != "li":
+                # e.g. a list directly nested in another list
+                lines.append(self.render_children(li).strip("\n"))
+                continue
+            if element.name == "ol":
+                mark = f"{idx+1}."
+            else:
+                mark = "-"
+            lines.append(self.render_li_element(li, mark))
+            idx += 1
+        self.list_level -= 1
+        return lines
+
+    def render_block_parts(self, element) -> list[str]:
+        # inline parts are joined into one line, and blocks (nested lists, code blocks)
+        # are kept as lines; inline and block parts alternate, starting with inline
+        parts = []
+        self.write_children(element, parts)
+        chunks, texts = [], []
+        for part in parts + [MarkdownBlock("")]:
+            if isinstance(part, MarkdownBlock):
+                chunks.append(self.collapse_spaces("".join(texts)))
+                chunks.append(part.strip("\n"))
+                texts = []
+            else:
+                texts.append(part)
+        return chunks
+
+    def render_li_element(self, li, mark):
+        chunks = self.render_block_parts(li)
+        text = chunks[0]
+        text = re.sub(r"^\s*•\s*", "", text)
+        indent_str = "  " * self.list_level
+        lines = [f"{indent_str}{mark} {text}".rstrip()]
+        lines.extend(chunk for chunk in chunks[1:] if chunk.strip())
+        return "\n".join(lines)
+
+    def write_def_element(self, element, out: list):
+        out.append("\n")
+        for child in element.children:
+            if not isinstance(child, Tag):
+                continue
+            if child.name == "dt":
+                text = self.collapse_spaces(self.render_children(child))
+                out.append(f"\n{text}")
+            elif child.name == "dd":
+                chunks = self.render_block_parts(child)
+                out.append(f"\n: {chunks[0]}")
+                out.extend(f"\n{chunk}" for chunk in chunks[1:] if chunk.strip())
+            else:
+                self.write_node(child, out)
+        out.append("\n\n")
+
+    def find_table_rows(self, table):
+        # rows of this table, excluding rows of nested tables
+        rows = []
+        stack = [child for child in reversed(table.contents) if isinstance(child, Tag)]
+        while stack:
+            element = stack.pop()
+            if element.name == "tr":
+                rows.append(element)
+            elif element.name != "table":
+                stack.extend(
+                    child
+                    for child in reversed(element.contents)
+                    if isinstance(child, Tag)
+                )
+        return rows
+
+    def write_table_element(self, element, out: list):
+        rows = self.get_table_rows(element)
+        if not rows:
+            return
+        out.append("\n\n" + self.render_table_rows(rows) + "\n\n")
+
+    def get_table_rows(self, element) -> list[list[str]]:
+        rows = []
+        for tr in self.find_table_rows(element):
+            cells = [
+                self.render_cell_element(cell)
+                for cell in tr.children
+                if isinstance(cell, Tag) and cell.name in ["td", "th"]
+            ]
+            if cells:
+                rows.append(cells)
+        return rows
+
+    def render_cell_element(self, cell) -> str:
+        # a row is one line, so lines of blocks in cells are joined with <br>,
+        # and each line of code blocks is inline code, as fences can not be in rows
+        lines = []
+        for idx, chunk in enumerate(self.render_block_parts(cell)):
+            if idx % 2 == 1 and chunk.startswith(ENV_MARK_MAP["pre"]):
+                for line in chunk.split("\n")[1:-1]:
+                    if line.strip():
+                        mark = "``" if "`" in line else "`"
+                        lines.append(f"{mark}{line}{mark}")
+            elif chunk.strip():
+                lines.extend(chunk.split("\n"))
+        return "<br>".join(lines).replace("|", "\\|")
+
+    def render_table_rows(self, rows: list[list[str]]) -> str:
+        # the first row is the header
+        col_count = max(len(row) for row in rows)
+        rows = [row + [""] * (col_count - len(row)) for row in rows]
+        lines = [f"| {' | '.join(row)} |" for row in rows]
+        lines.insert(1, f"|{' --- |' * col_count}")
+        return "\n".join(lines)
+
+    def remove_extra_lines(self, s):
+        return re.sub(r"\n(?:[ \t]*\n){2,}", "\n\n", s)
+
+    def convert(self, html_str: Union[str, BeautifulSoup]):
+        if isinstance(html_str, BeautifulSoup):
+            soup = html_str
+        else:
+            soup = parse_html(html_str, self.parser)
+        out = []
+        self.write_children(soup, out)
+        md_str = self.remove_extra_lines("".join(out))
+        return md_str
+
+
+def html2md(
+    html_str: Union[str, BeautifulSoup],
+    backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+):
+    parser = resolve_parser(parser)
+    if backend == "stream":
+        converter = StreamMarkdownConverter(parser=parser)
+    else:
+        converter = HTMLToMarkdownConverter(parser=parser)
+    budget = OutputBudget(max_output_chars, max_output_tokens, token_counter)
+    if not budget.enabled:
+        return converter.convert(html_str)
+    # blocks over the budget are dropped before converting, so they cost nothing
+    if isinstance(html_str, BeautifulSoup):
+        soup = html_str
+    else:
+        soup = parse_html(html_str, parser)
+    budget.truncate_soup(soup, "markdown")
+    md_str, _ = budget.cut_text(converter.convert(soup).strip())
+    return md_str
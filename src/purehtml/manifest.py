@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+
+from pathlib import Path
+from typing import Union
+
+from .cache import RULES_FINGERPRINT
+
+MANIFEST_NAME = ".purehtml-manifest.json"
+
+
+def get_file_hash(path: Union[Path, str]) -> str:
+    # same hash as `encoding.get_input_state()`
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as rf:
+        for block in iter(lambda: rf.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def get_settings_fingerprint(settings: dict) -> str:
+    settings_str = json.dumps([RULES_FINGERPRINT, settings], sort_keys=True)
+    return hashlib.blake2b(settings_str.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class BatchManifest:
+    # Records input size, mtime and hash, and the settings fingerprint of each output,
+    # in a manifest file next to the outputs of each directory.
+    # Inputs with the same size and mtime are up-to-date without being opened;
+    # inputs only touched (same size and hash) are up-to-date after one read.
+    def __init__(self, settings: dict):
+        self.settings_fingerprint = get_settings_fingerprint(settings)
+        self.manifests = {}
+        self.dirty_dirs = set()
+        self.lock = threading.Lock()
+
+    def get_manifest(self, dir_path: Path) -> dict:
+        if dir_path not in self.manifests:
+            manifest_path = dir_path / MANIFEST_NAME
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as rf:
+                    self.manifests[dir_path] = json.load(rf)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.manifests[dir_path] = {}
+        return self.manifests[dir_path]
+
+    def is_up_to_date(
+        self, html_path: Union[Path, str], output_path: Union[Path, str]
+    ) -> bool:
+        html_path, output_path = Path(html_path), Path(output_path)
+        with self.lock:
+            manifest = self.get_manifest(output_path.parent)
+            entry = manifest.get(output_path.name)
+            if (
+                not entry
+                or entry["settings"] != self.settings_fingerprint
+                or entry["input"] != html_path.name
+            ):
+                return False
+            try:
+                html_stat = html_path.stat()
+                if not output_path.exists():
+                    return False
+            except FileNotFoundError:
+                return False
+            if entry["size"] != html_stat.st_size:
+                return False
+            if entry["mtime_ns"] == html_stat.st_mtime_ns:
+                return True
+            if entry["hash"] == get_file_hash(html_path):
+                entry["mtime_ns"] = html_stat.st_mtime_ns
+                self.dirty_dirs.add(output_path.parent)
+                return True
+            return False
+
+    def record(
+        self,
+        html_path: Union[Path, str],
+        output_path: Union[Path, str],
+        input_state: dict = None,
+    ):
+        # `input_state` is taken by workers from the bytes they purified,
+        # so a file changed during purification is not recorded as up-to-date,
+        # and it is not read again here; without it, the file is read now
+        html_path, output_path = Path(html_path), Path(output_path)
+        if input_state is None:
+            html_stat = html_path.stat()
+            input_state = {
+                "size": html_stat.st_size,
+                "mtime_ns": html_stat.st_mtime_ns,
+                "hash": get_file_hash(html_path),
+            }
+        entry = {
+            "input": html_path.name,
+            "size": input_state["size"],
+            "mtime_ns": input_state["mtime_ns"],
+            "hash": input_state["hash"],
+            "settings": self.settings_fingerprint,
+        }
+        with self.lock:
+            self.get_manifest(output_path.parent)[output_path.name] = entry
+            self.dirty_dirs.add(output_path.parent)
+
+    def save(self):
+        with self.lock:
+            for dir_path in self.dirty_dirs:
+                manifest_path = dir_path / MANIFEST_NAME
+                temp_path = manifest_path.with_name(
+                    f"{MANIFEST_NAME}.{os.getpid()}.tmp"
+                )
+                with open(temp_path, "w", encoding="utf-8") as wf:
+                    json.dump(self.manifests[dir_path], wf, ensure_ascii=False)
+                os.replace(temp_path, manifest_path)
+            self.dirty_dirs.clear()
@@ -0,0 +1,201 @@
+import collections
+import heapq
+import random
+import time
+
+from typing import Union
+
+STAGES = [
+    "read",
+    "decode",
+    "prestrip",
+    "parse",
+    "filter_elements",
+    "normalize",
+    "filter_attrs",
+    "transform_protect_elements",
+    "boilerplate",
+    "truncate",
+    "chunk",
+    "html2md",
+    "serialize",
+    "write",
+]
+PERCENTILES = [50, 90, 99]
+# values kept per stage for percentiles, so memory does not grow with the batch
+RESERVOIR_SIZE = 10000
+
+
+class StageTimer:
+    def __init__(self, metrics: "PurifyMetrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        # cpu time of this thread, so that threads of a pool do not count each other
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        stage_times = self.metrics.stages.setdefault(self.stage, [0.0, 0.0])
+        stage_times[0] += wall
+        stage_times[1] += cpu
+
+
+class NullStageTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class NullMetrics:
+    # Default sink of metrics calls when metrics are disabled.
+    # Every hook is a no-op, so the disabled path costs one method call per stage.
+    enabled = False
+    NULL_TIMER = NullStageTimer()
+
+    def stage(self, stage: str):
+        return self.NULL_TIMER
+
+    def add_rule(self, rule: tuple):
+        pass
+
+    def set(self, key: str, value):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class PurifyMetrics:
+    # Wall/cpu seconds of each stage, input/output bytes, node counts
+    # and fired removal rules of one document.
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+        self.rules = collections.Counter()
+
+    def stage(self, stage: str) -> StageTimer:
+        return StageTimer(self, stage)
+
+    def add_rule(self, rule: tuple):
+        self.rules[f"{rule[0]}:{rule[1]}"] += 1
+
+    def set(self, key: str, value):
+        self.counts[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "stages": {
+                stage: {"wall": wall, "cpu": cpu}
+                for stage, (wall, cpu) in self.stages.items()
+            },
+            "wall": sum(wall for wall, _ in self.stages.values()),
+            "cpu": sum(cpu for _, cpu in self.stages.values()),
+            **self.counts,
+            "rules": dict(self.rules),
+        }
+
+
+def get_percentile(sorted_values: list, percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))
+    return sorted_values[idx]
+
+
+class ValueReservoir:
+    # Total, max and a uniform sample of at most `size` values (reservoir sampling),
+    # so percentiles are exact up to `size` values, and estimated beyond.
+    def __init__(self, size: int = RESERVOIR_SIZE):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.values = []
+        # seeded, so summaries of the same batch are the same
+        self.random = random.Random(0)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            idx = self.random.randrange(self.count)
+            if idx < self.size:
+                self.values[idx] = value
+
+    def summary(self) -> dict:
+        sorted_values = sorted(self.values)
+        summary = {"total": self.total}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile}"] = get_percentile(sorted_values, percentile)
+        summary["max"] = self.max
+        return summary
+
+
+class BatchMetrics:
+    # Aggregates per-document metrics of a batch:
+    # totals and percentiles of stage times, byte and node counts, fired rules,
+    # and the slowest documents, which are the ones to look at for p99.
+    def __init__(self, slowest_count: int = 20):
+        self.slowest_count = slowest_count
+        self.doc_count = 0
+        self.stage_walls = collections.defaultdict(ValueReservoir)
+        self.stage_cpus = collections.defaultdict(float)
+        self.doc_walls = ValueReservoir()
+        self.counts = collections.Counter()
+        self.rules = collections.Counter()
+        self.slowest = []
+
+    def add(self, path: Union[str, object], doc_metrics: dict):
+        if not doc_metrics:
+            return
+        self.doc_count += 1
+        for stage, stage_times in doc_metrics["stages"].items():
+            self.stage_walls[stage].add(stage_times["wall"])
+            self.stage_cpus[stage] += stage_times["cpu"]
+        wall = doc_metrics["wall"]
+        self.doc_walls.add(wall)
+        for key, value in doc_metrics.items():
+            if key not in ("stages", "rules", "wall", "cpu") and isinstance(
+                value, (int, float)
+            ):
+                self.counts[key] += value
+        self.rules.update(doc_metrics["rules"])
+        slow_item = (wall, str(path))
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, slow_item)
+        else:
+            heapq.heappushpop(self.slowest, slow_item)
+
+    def summary(self) -> dict:
+        stages = {}
+        stage_order = {stage: idx for idx, stage in enumerate(STAGES)}
+        for stage in sorted(
+            self.stage_walls, key=lambda s: stage_order.get(s, len(STAGES))
+        ):
+            stages[stage] = {
+                **self.stage_walls[stage].summary(),
+                "cpu": self.stage_cpus[stage],
+            }
+        return {
+            "docs": self.doc_count,
+            "wall": self.doc_walls.summary(),
+            "stages": stages,
+            "counts": dict(self.counts),
+            "rules": dict(self.rules.most_common()),
+            "slowest": [
+                {"path": path, "wall": wall}
+                for wall, path in sorted(self.slowest, reverse=True)
+            ],
+        }
@@ -0,0 +1,92 @@
+import difflib
+import warnings
+
+from pathlib import Path
+from typing import Literal, Union
+
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+
+PARSERS = ["lxml", "html5lib", "html.parser"]
+# parser for markup fragments, as lxml and html5lib wrap them into <html><body>
+FRAGMENT_PARSER = "html.parser"
+
+ParserType = Literal["auto", "lxml", "html5lib", "html.parser"]
+
+
+def is_parser_available(parser: str) -> bool:
+    return builder_registry.lookup(parser) is not None
+
+
+def resolve_parser(parser: ParserType = "html.parser") -> str:
+    # "auto" picks the fastest installed parser,
+    # and a missing parser falls back to the built-in "html.parser"
+    if parser == "auto":
+        for candidate in PARSERS:
+            if is_parser_available(candidate):
+                return candidate
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser: {parser}")
+    if not is_parser_available(parser):
+        warnings.warn(f'Parser "{parser}" is not installed, use "html.parser"')
+        return "html.parser"
+    return parser
+
+
+def parse_html(html_str: str, parser: str = "html.parser") -> BeautifulSoup:
+    return BeautifulSoup(html_str, parser)
+
+
+def compare_parser_outputs(
+    html_paths: list[Union[Path, str]],
+    parsers: list[str] = None,
+    base_parser: str = "html.parser",
+    **purifier_kwargs,
+) -> list[dict]:
+    # Purify each file with each parser, and compare outputs with `base_parser`.
+    # `ratio` is the similarity of the outputs, 1.0 means identical.
+    from .purehtml import HTMLPurifier
+
+    parsers = [parser for parser in (parsers or PARSERS) if is_parser_available(parser)]
+    purifiers = {
+        parser: HTMLPurifier(parser=parser, **purifier_kwargs)
+        for parser in [base_parser, *parsers]
+    }
+    reports = []
+    for html_path in html_paths:
+        with open(html_path, "r", encoding="utf-8", errors="ignore") as rf:
+            html_str = rf.read()
+        base_output = purifiers[base_parser].purify_str(html_str)
+        for parser in parsers:
+            if parser == base_parser:
+                continue
+            output = purifiers[parser].purify_str(html_str)
+            matcher = difflib.SequenceMatcher(
+                None, base_output.splitlines(), output.splitlines(), autojunk=False
+            )
+            reports.append(
+                {
+                    "path": html_path,
+                    "parser": parser,
+                    "identical": output == base_output,
+                    "ratio": matcher.ratio(),
+                }
+            )
+    return reports
+
+
+if __name__ == "__main__":
+    from tclogger import logger
+
+    html_root = Path(__file__).parent / "samples"
+    html_paths = sorted(list(html_root.glob("*.html")), key=lambda x: x.name)
+    for output_format in ["html", "markdown"]:
+        logger.note(f"> Comparing parsers with output_format={output_format}")
+        for report in compare_parser_outputs(html_paths, output_format=output_format):
+            logger.mesg(
+                f"  * [{report['parser']}] "
+                f"identical={report['identical']}, ratio={report['ratio']:.4f}: "
+                f"{Path(report['path']).name}"
+            )
+
+    # python -m purehtml.parsers
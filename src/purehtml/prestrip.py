@@ -0,0 +1,151 @@
+import re
+
+from typing import Iterable, Tuple, Union
+
+from .constants import COMMON_REMOVE_TAGS, PROTECT_TAGS
+
+# content of these tags is not markup, so it is skipped without looking for tags in it
+RAW_TEXT_TAGS = ["script", "style", "textarea", "title", "xmp"]
+VOID_TAGS = ["link", "meta", "br", "hr", "img", "input", "source", "base"]
+
+# end of a start tag, with quoted attribute values which may contain ">"
+TAG_END_PATTERN = r"""(?:[^>"']|"[^"]*"|'[^']*')*>"""
+
+
+class HTMLPreStripper:
+    # Remove blocks of tags which are always removed by `HTMLPurifier.filter_elements`,
+    # and comments, from the raw string or bytes before it is parsed into a tree.
+    # Tags inside `PROTECT_TAGS` (<math>) are kept, as the purifier keeps them.
+    # Each start tag is skipped as a whole, so tags in quoted attribute values
+    # are never taken as tokens, and text between tags is copied as is.
+    def __init__(
+        self,
+        remove_tags: Iterable[str] = COMMON_REMOVE_TAGS,
+        protect_tags: Iterable[str] = PROTECT_TAGS,
+    ):
+        self.remove_tags = frozenset(tag.lower() for tag in remove_tags)
+        self.protect_tags = frozenset(tag.lower() for tag in protect_tags)
+        # tags which are handled, other tags are skipped
+        self.token_names = self.remove_tags | self.protect_tags | set(RAW_TEXT_TAGS)
+        token_pattern = r"<!--|<(/?)([a-zA-Z][^\s/>]*)"
+        self.patterns = {
+            str: self.compile_patterns(token_pattern),
+            bytes: self.compile_patterns(token_pattern.encode("ascii")),
+        }
+
+    def compile_patterns(self, token_pattern):
+        is_bytes = isinstance(token_pattern, bytes)
+        encode = (lambda s: s.encode("ascii")) if is_bytes else (lambda s: s)
+        return {
+            "token": re.compile(token_pattern, flags=re.IGNORECASE),
+            "tag_end": re.compile(encode(TAG_END_PATTERN)),
+            "comment_end": encode("-->"),
+            "start_tag": re.compile(encode(r"<([a-zA-Z][^\s/>]*)"), re.IGNORECASE),
+            "end_tag": re.compile(encode(r"</([a-zA-Z][^\s/>]*)"), re.IGNORECASE),
+            "decode": (lambda b: b.decode("ascii", "ignore")) if is_bytes else str,
+        }
+
+    def find_end_tag(self, html, patterns, name: str, pos: int) -> Tuple[int, int]:
+        # (start, end) of the next </name>, or (-1, -1)
+        decode = patterns["decode"]
+        for match in patterns["end_tag"].finditer(html, pos):
+            if decode(match.group(1)).lower() == name:
+                tag_end = patterns["tag_end"].match(html, match.end())
+                if tag_end:
+                    return match.start(), tag_end.end()
+                break
+        return -1, -1
+
+    def is_balanced(self, html, patterns, name: str, start: int, end: int) -> bool:
+        # no end tag in html[start:end] closes an element opened before `start`,
+        # and no <name> is left open, so removing the span removes exactly one element
+        decode = patterns["decode"]
+        opened = {}
+        tags = sorted(
+            [
+                (m.start(), 1, m)
+                for m in patterns["start_tag"].finditer(html, start, end)
+            ]
+            + [
+                (m.start(), -1, m)
+                for m in patterns["end_tag"].finditer(html, start, end)
+            ],
+            key=lambda x: x[0],
+        )
+        for _, delta, match in tags:
+            tag_name = decode(match.group(1)).lower()
+            if tag_name in VOID_TAGS:
+                continue
+            opened[tag_name] = opened.get(tag_name, 0) + delta
+            if opened[tag_name] < 0:
+                return False
+        return opened.get(name, 0) == 0
+
+    def strip(self, html: Union[str, bytes]) -> Union[str, bytes]:
+        patterns = self.patterns[bytes if isinstance(html, bytes) else str]
+        decode = patterns["decode"]
+        parts = []
+        copy_from = 0
+        pos = 0
+        protect_depth = 0
+
+        while True:
+            match = patterns["token"].search(html, pos)
+            if not match:
+                break
+
+            if match.group(2) is None:
+                # comments are removed everywhere, also in protected tags
+                comment_end = html.find(patterns["comment_end"], match.end())
+                if comment_end < 0:
+                    break
+                parts.append(html[copy_from : match.start()])
+                copy_from = pos = comment_end + 3
+                continue
+
+            is_end_tag = bool(match.group(1))
+            name = decode(match.group(2)).lower()
+            tag_end = patterns["tag_end"].match(html, match.end())
+            if not tag_end:
+                break
+            pos = tag_end.end()
+            if name not in self.token_names:
+                continue
+
+            if is_end_tag:
+                if name in self.protect_tags:
+                    protect_depth = max(0, protect_depth - 1)
+                continue
+
+            is_self_closing = html[pos - 2 : pos - 1] in ("/", b"/")
+            if name in self.protect_tags:
+                if not is_self_closing:
+                    protect_depth += 1
+                continue
+
+            if is_self_closing or name in VOID_TAGS:
+                block_end = pos
+            elif name in RAW_TEXT_TAGS:
+                _, block_end = self.find_end_tag(html, patterns, name, pos)
+                if block_end < 0:
+                    break
+            elif name in self.remove_tags and protect_depth == 0:
+                end_tag_start, block_end = self.find_end_tag(html, patterns, name, pos)
+                if block_end < 0 or not self.is_balanced(
+                    html, patterns, name, pos, end_tag_start
+                ):
+                    continue
+            else:
+                continue
+
+            if name in self.remove_tags and protect_depth == 0:
+                parts.append(html[copy_from : match.start()])
+                copy_from = block_end
+            pos = block_end
+
+        parts.append(html[copy_from:])
+        return html[:0].join(parts)
+
+
+def prestrip_html(html: Union[str, bytes]) -> Union[str, bytes]:
+    return HTMLPreStripper().strip(html)
@@ -1,23 +1,46 @@
+import collections
 import concurrent.futures
-import re
+import itertools
+import math
+import os
+import threading
 
 from pathlib import Path
-from typing import Union, Literal
+from typing import Callable, Iterable, Iterator, Literal, Optional, Tuple, Union
 
-from bs4 import BeautifulSoup, Comment
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
 from tclogger import logger
 from termcolor import colored
 
-from .constants import (
-    REMOVE_TAGS,
-    REMOVE_CLASSES,
-    ENV_TAGS,
-    GROUP_TAGS,
-    FORMAT_TAGS,
-    PROTECT_TAGS,
-    MATH_TAGS,
-)
+from .boilerplate import BoilerplatePage, BoilerplateTable
+from .budget import FULL_PAGE_RATIO, OutputBudget
+from .cache import PurifyCache
+from .chunks import DEFAULT_CHUNK_SIZE, HTMLChunker, join_chunks
+from .config import TagConfig
+from .encoding import decode_html_bytes, read_html_bytes_file
 from .html2md import html2md
+from .manifest import BatchManifest
+from .metrics import NULL_METRICS, BatchMetrics, PurifyMetrics
+from .parsers import ParserType, parse_html, resolve_parser
+from .rulepacks import (
+    CompiledRules,
+    compile_rule_packs,
+    detect_page_url,
+    get_host,
+    get_rule_pack_names,
+    get_rule_packs_fingerprint,
+    get_rule_packs_state,
+    get_rule_packs_version,
+    set_rule_packs_state,
+)
+from .sinks import OutputSink, SinkType, SinkWriter, create_sink
+from .sources import SourceType, iter_sources_records
+from .traverse import (
+    find_all_contain_tags,
+    find_all_has_text,
+    find_all_in_tags,
+    find_all_outermost,
+)
 
 
 class HTMLPurifier:
@@ -29,6 +52,18 @@ class HTMLPurifier:
         keep_format_tags: bool = True,
         keep_group_tags: bool = True,
         math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+        markdown_backend: Literal["soup", "stream"] = "soup",
+        parser: ParserType = "html.parser",
+        prestrip: bool = False,
+        site_rules: Literal["all", "auto"] = "all",
+        max_output_chars: int = None,
+        max_output_tokens: int = None,
+        token_counter: Callable[[str], int] = None,
+        chunk_size: int = None,
+        boilerplate_threshold: float = None,
+        cache: bool = False,
+        cache_path: Union[Path, str] = None,
+        metrics: bool = False,
     ):
         self.verbose = verbose
         self.output_format = output_format
@@ -36,143 +71,251 @@ class HTMLPurifier:
         self.keep_format_tags = keep_format_tags
         self.keep_group_tags = keep_group_tags
         self.math_style = math_style
+        self.markdown_backend = markdown_backend
+        self.parser = resolve_parser(parser)
+        self.tag_config = TagConfig.from_options(
+            keep_format_tags=keep_format_tags, keep_group_tags=keep_group_tags
+        )
+        self.prestrip = prestrip
+        if site_rules not in ("all", "auto"):
+            raise ValueError(f"Unknown site_rules: {site_rules}")
+        self.site_rules = site_rules
+        # compiled rules by (packs version, pack names), and pack names by host
+        self.compiled_rules = {}
+        self.host_pack_names = {}
+        compiled_rules = self.get_compiled_rules()
+        self.rule_matcher = compiled_rules.rule_matcher
+        self.prestripper = compiled_rules.prestripper
+        self.budget = OutputBudget(
+            max_chars=max_output_chars,
+            max_tokens=max_output_tokens,
+            token_counter=token_counter,
+        )
+        self.chunk_size = chunk_size
+        self.boilerplate_threshold = boilerplate_threshold
+        if boilerplate_threshold:
+            self.boilerplate = BoilerplateTable(threshold=boilerplate_threshold)
+        else:
+            self.boilerplate = None
+        self.cache_path = str(cache_path) if cache_path else None
+        if cache or cache_path:
+            self.cache = PurifyCache(path=cache_path)
+        else:
+            self.cache = None
+        self.metrics = metrics
 
-    def transform_math_element(self, element):
-        def _set_math_attrs(element):
-            if element.name == "math":
-                element.attrs = {
-                    "display": element.get("display", ""),
-                    "title": element.get("alttext", "") or element.get("title", ""),
-                }
-
-        def _unwrap_table(element):
-            # in ar5iv, <math> with block display is wrapped in a table
-            if (
-                element.parent.name == "td"
-                and element.parent.parent.name == "tr"
-                and element.parent.parent.parent.name == "table"
-            ) and (
-                len(element.parent.parent.find_all("td")) == 1
-                and len(element.parent.parent.parent.find_all("tr")) == 1
-            ):
-                for i in range(3):
-                    element.parent.unwrap()
+    def log(self, level: str, msg: str):
+        # logging is controlled by this instance, instead of toggling the global
+        # quiet state of `logger`, which is shared by all threads
+        if self.verbose:
+            getattr(logger, level)(msg)
 
-        _set_math_attrs(element)
+    def get_settings(self) -> dict:
+        # params which affect the output
+        return {
+            "output_format": self.output_format,
+            "keep_href": self.keep_href,
+            "keep_format_tags": self.keep_format_tags,
+            "keep_group_tags": self.keep_group_tags,
+            "math_style": self.math_style,
+            "markdown_backend": self.markdown_backend,
+            "parser": self.parser,
+            "prestrip": self.prestrip,
+            "site_rules": self.site_rules,
+            "max_output_chars": self.budget.max_chars,
+            "max_output_tokens": self.budget.max_tokens,
+            "token_counter": self.budget.get_counter_name(),
+            "chunk_size": self.chunk_size,
+            "boilerplate_threshold": self.boilerplate_threshold,
+        }
 
-        for ele in element.find_all():
-            _set_math_attrs(ele)
-            if (ele.name not in MATH_TAGS) and (not ele.find_all("math")):
-                ele.extract()
-            else:
+    def get_config(self) -> dict:
+        # plain init params, which are cheap to pickle and enough to rebuild the purifier,
+        # and registered rule packs, so that workers apply the same rules
+        return {
+            "verbose": self.verbose,
+            **self.get_settings(),
+            "token_counter": self.budget.token_counter,
+            "cache": self.cache is not None,
+            "cache_path": self.cache_path,
+            "metrics": self.metrics,
+            "rule_packs": get_rule_packs_state(),
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> "HTMLPurifier":
+        config = dict(config)
+        rule_packs = config.pop("rule_packs", None)
+        if rule_packs is not None:
+            set_rule_packs_state(rule_packs)
+        return cls(**config)
+
+    def get_page_host(self, url: str = None, html_str=None) -> Optional[str]:
+        host = get_host(url)
+        if host is None and html_str:
+            host = get_host(detect_page_url(html_str))
+        return host
+
+    def get_pack_names(self, url: str = None, html_str=None) -> Tuple[str, ...]:
+        if self.site_rules == "all":
+            return get_rule_pack_names(all_packs=True)
+        host = self.get_page_host(url, html_str)
+        key = (get_rule_packs_version(), host)
+        if key not in self.host_pack_names:
+            if len(self.host_pack_names) >= 10000:
+                self.host_pack_names.clear()
+            self.host_pack_names[key] = get_rule_pack_names(host)
+        return self.host_pack_names[key]
+
+    def get_compiled_rules(self, url: str = None, html_str=None) -> CompiledRules:
+        # with "all", every registered pack applies to every page;
+        # with "auto", only the common pack and the packs of the page host,
+        # which is taken from `url`, or detected from the head of the page
+        version = get_rule_packs_version()
+        pack_names = self.get_pack_names(url, html_str)
+        key = (version, pack_names)
+        if key not in self.compiled_rules:
+            # dict writes are atomic, so threads at worst compile the same rules twice
+            self.compiled_rules[key] = compile_rule_packs(
+                pack_names, self.tag_config.protect_tags, self.prestrip
+            )
+        return self.compiled_rules[key]
+
+    def filter_math_subtree(self, element):
+        # keep mathml tags and tags which contain a nested <math>, without attrs,
+        # and extract others; the subtree is walked once,
+        # instead of searching for <math> again under each descendant
+        math_tags = self.tag_config.math_tags
+        descendants = element.find_all()
+        contain_ids = find_all_contain_tags(element, ["math"], elements=descendants)
+        extracted_ids = set()
+        for ele in descendants:
+            if id(ele.parent) in extracted_ids:
+                # already dropped with its extracted ancestor
+                extracted_ids.add(id(ele))
+            elif ele.name in math_tags or id(ele) in contain_ids:
                 ele.attrs = {}
+            else:
+                ele.extract()
+                extracted_ids.add(id(ele))
 
-        display = element.get("display", "")
+    def unwrap_math_table(self, element):
+        # in ar5iv, <math> with block display is wrapped in a table
+        if (
+            element.parent.name == "td"
+            and element.parent.parent.name == "tr"
+            and element.parent.parent.parent.name == "table"
+        ) and (
+            len(element.parent.parent.find_all("td", limit=2)) == 1
+            and len(element.parent.parent.parent.find_all("tr", limit=2)) == 1
+        ):
+            for i in range(3):
+                element.parent.unwrap()
 
+    def transform_math_element(self, element, soup: BeautifulSoup = None):
+        # `soup` creates the wrapper tags, instead of parsing a new soup for each
+        if soup is None:
+            soup = BeautifulSoup("", self.parser)
+        element.attrs = {
+            "display": element.get("display", ""),
+            "title": element.get("alttext", "") or element.get("title", ""),
+        }
+        display = element["display"]
         if display == "block":
-            _unwrap_table(element)
-            new_tag = BeautifulSoup("<div></div>", "html.parser").div
+            self.unwrap_math_table(element)
+            new_tag = soup.new_tag("div")
             new_tag["align"] = "center"
         else:
-            new_tag = BeautifulSoup("<span></span>", "html.parser").span
+            new_tag = soup.new_tag("span")
 
         if self.math_style == "html":
-            new_tag["title"] = element.get("title", "")
+            self.filter_math_subtree(element)
+            new_tag["title"] = element["title"]
             element.attrs = {}
             element.wrap(new_tag)
         else:  # self.math_style == latex*
-            latex_str = element.get("title", "")
-            latex_str = latex_str.replace("\\displaystyle", "")
-
+            # latex is taken from `alttext`, so the mathml subtree is dropped unvisited
+            latex_str = element["title"].replace("\\displaystyle", "")
             if display == "block":
-                new_tag.string = f"\n$$ {latex_str} $$\n"
+                latex_str = f"\n$$ {latex_str} $$\n"
             else:
-                new_tag.string = f" ${latex_str}$ "
+                latex_str = f" ${latex_str}$ "
 
             if self.math_style == "latex_in_tag":
+                new_tag.string = latex_str
                 element.replace_with(new_tag)
             else:
-                element.replace_with(new_tag.string)
-
-    def is_element_protected(self, element):
-        return (element.name in PROTECT_TAGS) or any(
-            parent.name in PROTECT_TAGS for parent in element.parents
-        )
-
-    def filter_elements(self, html_str):
-        soup = BeautifulSoup(html_str, "html.parser")
+                element.replace_with(NavigableString(latex_str))
 
+    def filter_soup_elements(
+        self, soup: BeautifulSoup, metrics=NULL_METRICS, rule_matcher=None
+    ):
+        rule_matcher = rule_matcher or self.rule_matcher
         # Remove comments
         comments = soup.find_all(string=lambda text: isinstance(text, Comment))
         for comment in comments:
             comment.extract()
+        metrics.set("comments_removed", len(comments))
 
         # Remove elements with patterns of classes and ids
         removed_element_count = 0
         unwrapped_element_count = 0
-        for element in soup.find_all():
-            try:
-                class_attr = element.get("class", [])
-                class_str = " ".join(list(class_attr))
-            except:
-                class_str = ""
-
-            try:
-                id_str = element.get("id", "")
-            except:
-                id_str = ""
-
-            class_id_str = f"{class_str} {id_str}"
-
-            is_in_remove_classes = any(
-                re.search(remove_class, class_id_str, flags=re.IGNORECASE)
-                for remove_class in REMOVE_CLASSES
-            )
-            is_in_remove_tags = element.name in REMOVE_TAGS
-            is_in_protect_tags = self.is_element_protected(element)
-
-            if (not is_in_protect_tags) and (is_in_remove_tags or is_in_remove_classes):
+        for element, is_in_protect_tags in find_all_in_tags(
+            soup, self.tag_config.protect_tags
+        ):
+            if is_in_protect_tags:
+                continue
+            rule = rule_matcher.match(element)
+            if rule:
                 element.extract()
                 removed_element_count += 1
+                metrics.add_rule(rule)
 
         # Unwrap tags by [env, group, format], and remove empty elements
-        KEEP_TAGS = ENV_TAGS
-        if self.keep_group_tags:
-            KEEP_TAGS.extend(GROUP_TAGS)
-        if self.keep_format_tags:
-            KEEP_TAGS.extend(FORMAT_TAGS)
-
-        for element in soup.find_all():
-            if self.is_element_protected(element):
-                continue
-
-            is_in_keep_tags = element.name in KEEP_TAGS
+        keep_tags = self.tag_config.keep_tags
 
+        elements = find_all_in_tags(soup, self.tag_config.protect_tags)
+        has_text_ids = find_all_has_text([element for element, _ in elements])
+        for element, is_in_protect_tags in elements:
             if is_in_protect_tags:
                 continue
 
+            is_in_keep_tags = element.name in keep_tags
+
             if not is_in_keep_tags:
                 element.unwrap()
                 unwrapped_element_count += 1
-            elif not element.get_text().strip():
+            elif id(element) not in has_text_ids:
                 element.extract()
                 removed_element_count += 1
             else:
                 pass
 
-        logger.mesg(
-            f"  - Elements: "
-            f'{colored(len(soup.find_all()),"light_green")} (Remained) '
-            f'/ {colored(removed_element_count,"light_red")} (Removed)'
-            f'/ {colored(unwrapped_element_count,"light_yellow")} (Unwrapped)'
-        )
+        metrics.set("nodes_removed", removed_element_count)
+        metrics.set("nodes_unwrapped", unwrapped_element_count)
+        # counting remained elements walks the whole tree, so only do it when shown
+        if self.verbose or metrics.enabled:
+            remained_element_count = len(soup.find_all())
+            metrics.set("nodes_remained", remained_element_count)
+            self.log(
+                "mesg",
+                f"  - Elements: "
+                f'{colored(remained_element_count,"light_green")} (Remained) '
+                f'/ {colored(removed_element_count,"light_red")} (Removed)'
+                f'/ {colored(unwrapped_element_count,"light_yellow")} (Unwrapped)',
+            )
 
-        return str(soup)
+        return soup
 
-    def filter_attrs(self, html_str):
-        soup = BeautifulSoup(html_str, "html.parser")
-        for element in soup.find_all():
-            if self.is_element_protected(element):
+    def filter_elements(self, html_str):
+        soup = parse_html(html_str, self.parser)
+        return str(self.filter_soup_elements(soup))
+
+    def filter_soup_attrs(self, soup: BeautifulSoup):
+        for element, is_in_protect_tags in find_all_in_tags(
+            soup, self.tag_config.protect_tags
+        ):
+            if is_in_protect_tags:
                 continue
             if element.name == "a":
                 if self.keep_href:
@@ -188,108 +331,699 @@ class HTMLPurifier:
             else:
                 element.attrs = {}
 
-        return str(soup)
+        return soup
+
+    def filter_attrs(self, html_str):
+        soup = parse_html(html_str, self.parser)
+        return str(self.filter_soup_attrs(soup))
+
+    def transform_soup_protect_elements(self, soup: BeautifulSoup):
+        if self.math_style == "html":
+            # nested formulas are kept in html, so each of them is transformed
+            math_elements = soup.find_all("math")
+        else:
+            # nested formulas are replaced along with their outermost formula
+            math_elements = find_all_outermost(soup, ["math"])
+        for element in math_elements:
+            self.transform_math_element(element, soup)
+        return soup
 
     def transform_protect_elements(self, html_str):
-        soup = BeautifulSoup(html_str, "html.parser")
-        for element in soup.find_all():
-            if element.name == "math":
-                self.transform_math_element(element)
-        return str(soup)
+        soup = parse_html(html_str, self.parser)
+        return str(self.transform_soup_protect_elements(soup))
+
+    def normalize_soup_strings(self, soup: BeautifulSoup):
+        # make the tree look like it was re-parsed from its serialization:
+        # merge adjacent strings, drop empty ones,
+        # and collapse whitespace-only strings outside of <pre> and <textarea>
+        soup.smooth()
+        preserve_tags = soup.builder.preserve_whitespace_tags or set()
+        stack = [(soup, False)]
+        while stack:
+            element, is_preserved = stack.pop()
+            for child in list(element.contents):
+                if isinstance(child, Tag):
+                    stack.append((child, is_preserved or child.name in preserve_tags))
+                elif not child:
+                    child.extract()
+                elif not is_preserved and not child.strip(soup.ASCII_SPACES):
+                    collapsed = "\n" if "\n" in child else " "
+                    if child != collapsed:
+                        child.replace_with(type(child)(collapsed))
+        return soup
 
-    def read_html_file(self, html_path):
-        logger.note(f"> Purifying content in: {html_path}")
+    def purify_soup(self, soup: BeautifulSoup, metrics=NULL_METRICS, rule_matcher=None):
+        # all stages share one parsed tree, and only the final output is serialized
+        with metrics.stage("filter_elements"):
+            self.filter_soup_elements(soup, metrics, rule_matcher)
+        with metrics.stage("normalize"):
+            self.normalize_soup_strings(soup)
+        with metrics.stage("filter_attrs"):
+            self.filter_soup_attrs(soup)
+        with metrics.stage("transform_protect_elements"):
+            self.transform_soup_protect_elements(soup)
+        return soup
+
+    def read_html_file(self, html_path, encoding: str = None, input_state=None):
+        self.log("note", f"> Purifying content in: {html_path}")
 
         if not Path(html_path).exists():
             warn_msg = f"File not found: {html_path}"
-            logger.warn(warn_msg)
+            self.log("warn", warn_msg)
             raise FileNotFoundError(warn_msg)
 
-        encodings = ["utf-8", "latin-1"]
-        for encoding in encodings:
-            try:
-                with open(html_path, "r", encoding=encoding, errors="ignore") as rf:
-                    html_str = rf.read()
-                    return html_str
-            except UnicodeDecodeError:
-                pass
+        html_str, encoding = read_html_bytes_file(
+            html_path, encoding=encoding, input_state=input_state
+        )
+        return html_str
+
+    def get_output_path(self, html_path) -> Path:
+        if self.output_format == "html":
+            return Path(str(html_path) + ".pure")
         else:
-            warn_msg = f"No matching encodings: {html_path}"
-            logger.warn(warn_msg)
-            raise UnicodeDecodeError(warn_msg)
+            return Path(str(html_path) + ".md")
+
+    def create_metrics(self):
+        return PurifyMetrics() if self.metrics else NULL_METRICS
 
-    def purify_file(self, html_path, save=True, output_path=None):
-        logger.enter_quiet(not self.verbose)
-        html_str = self.read_html_file(html_path)
+    def purify_file(
+        self,
+        html_path,
+        save=True,
+        output_path=None,
+        encoding=None,
+        url=None,
+        input_state: bool = False,
+    ):
+        # with `input_state`, results get "input_state" of the bytes which were read
+        metrics = self.create_metrics()
+        state = {} if input_state else None
+        with metrics.stage("read"):
+            html_str = self.read_html_file(
+                html_path, encoding=encoding, input_state=state
+            )
         if not html_str:
             return {"path": html_path, "output_path": None, "output": ""}
         else:
-            result = self.purify_str(html_str)
+            result, chunks = self.purify_output(html_str, metrics=metrics, url=url)
         if save:
-            if not output_path:
-                if self.output_format == "html":
-                    output_path = Path(str(html_path) + ".pure")
-                else:
-                    output_path = Path(str(html_path) + ".md")
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(output_path, "w", encoding="utf-8") as wf:
-                wf.write(result)
-            logger.success(f"  > Saved to: {output_path}")
-        logger.exit_quiet(not self.verbose)
-        return {"path": html_path, "output_path": output_path, "output": result}
-
-    def purify_str(self, html_str):
-        logger.enter_quiet(not self.verbose)
+            with metrics.stage("write"):
+                output_path = Path(output_path or self.get_output_path(html_path))
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(output_path, "w", encoding="utf-8") as wf:
+                    wf.write(result)
+            self.log("success", f"  > Saved to: {output_path}")
+        res = {"path": html_path, "output_path": output_path, "output": result}
+        if chunks is not None:
+            res["chunks"] = chunks
+        if state is not None:
+            res["input_state"] = state
+        if metrics.enabled:
+            res["metrics"] = metrics.to_dict()
+        return res
+
+    def purify_str(
+        self,
+        html_str: Union[str, bytes],
+        encoding: str = None,
+        metrics: PurifyMetrics = None,
+        url: str = None,
+    ):
+        # pass a PurifyMetrics to collect stage times and counts of this call,
+        # and the url (or host) of the page to pick its site rules
+        metrics = metrics or NULL_METRICS
+        if metrics.enabled and html_str:
+            if isinstance(html_str, str):
+                metrics.set("input_bytes", len(html_str.encode("utf-8", "replace")))
+            else:
+                metrics.set("input_bytes", len(html_str))
+
         if not html_str:
             return ""
 
-        html_str = self.filter_elements(html_str)
-        html_str = self.filter_attrs(html_str)
-        html_str = self.transform_protect_elements(html_str)
+        if self.chunk_size:
+            # the output which offsets of chunks point into
+            chunks = self.iter_purify_chunks(
+                html_str, encoding=encoding, metrics=metrics, url=url
+            )
+            result = join_chunks(chunks, self.output_format)
+            if metrics.enabled:
+                metrics.set("output_bytes", len(result.encode("utf-8", "replace")))
+            return result
+
+        compiled_rules = self.get_compiled_rules(url, html_str)
+        if self.boilerplate:
+            # outputs depend on pages seen before, so they are not cached
+            cache = None
+            boilerplate_page = self.boilerplate.start_page(
+                self.get_page_host(url, html_str)
+            )
+        else:
+            cache = self.cache
+            boilerplate_page = None
+        if cache:
+            cache_key = cache.make_key(
+                html_str,
+                {
+                    **self.get_settings(),
+                    "encoding": encoding,
+                    "rules": compiled_rules.fingerprint,
+                },
+            )
+            cached_result = cache.get(cache_key)
+            if cached_result is not None:
+                metrics.set("cache_hits", 1)
+                return cached_result
+
+        if isinstance(html_str, (bytes, bytearray)):
+            with metrics.stage("decode"):
+                html_str, encoding = decode_html_bytes(html_str, encoding=encoding)
+        if self.budget.enabled:
+            result = self.purify_decoded_str_in_budget(
+                html_str, compiled_rules, metrics, boilerplate_page
+            )
+        else:
+            result, _ = self.purify_decoded_str(
+                html_str, compiled_rules, metrics, boilerplate_page=boilerplate_page
+            )
+
+        if boilerplate_page:
+            boilerplate_page.finish()
+        if cache:
+            cache.set(cache_key, result)
+        if metrics.enabled:
+            metrics.set("output_bytes", len(result.encode("utf-8", "replace")))
+
+        return result
+
+    def purify_decoded_soup(
+        self,
+        html_str: str,
+        compiled_rules: CompiledRules,
+        metrics=NULL_METRICS,
+        boilerplate_page: BoilerplatePage = None,
+    ) -> BeautifulSoup:
+        if compiled_rules.prestripper:
+            with metrics.stage("prestrip"):
+                html_str = compiled_rules.prestripper.strip(html_str)
+        with metrics.stage("parse"):
+            soup = parse_html(html_str, self.parser)
+        if metrics.enabled:
+            metrics.set("nodes_parsed", len(soup.find_all()))
+        self.purify_soup(soup, metrics, compiled_rules.rule_matcher)
+        if boilerplate_page:
+            with metrics.stage("boilerplate"):
+                removed_count = boilerplate_page.filter_soup(soup)
+            metrics.set("boilerplate_removed", removed_count)
+        return soup
+
+    def purify_decoded_str(
+        self,
+        html_str: str,
+        compiled_rules: CompiledRules,
+        metrics=NULL_METRICS,
+        budget: OutputBudget = None,
+        boilerplate_page: BoilerplatePage = None,
+    ) -> Tuple[str, bool]:
+        # return (output, is_cut), where blocks over `budget` are dropped
+        soup = self.purify_decoded_soup(
+            html_str, compiled_rules, metrics, boilerplate_page
+        )
+        is_cut = False
+        if budget:
+            with metrics.stage("truncate"):
+                is_cut = budget.truncate_soup(soup, self.output_format)
 
         if self.output_format == "markdown":
-            html_str = html2md(html_str)
+            with metrics.stage("html2md"):
+                if self.markdown_backend == "soup":
+                    self.normalize_soup_strings(soup)
+                html_str = html2md(
+                    soup, backend=self.markdown_backend, parser=self.parser
+                )
+        else:
+            with metrics.stage("serialize"):
+                html_str = str(soup)
 
         result = html_str.strip()
+        if budget and self.output_format == "markdown":
+            # markdown marks are not counted when truncating the tree
+            with metrics.stage("truncate"):
+                result, _ = budget.cut_text(result)
+        return result, is_cut
+
+    def purify_decoded_str_in_budget(
+        self,
+        html_str: str,
+        compiled_rules: CompiledRules,
+        metrics=NULL_METRICS,
+        boilerplate_page: BoilerplatePage = None,
+    ) -> str:
+        # parsing costs most, so only a prefix of the page is purified,
+        # which grows until its output hits the budget, or it is the whole page.
+        # Blocks which end before the end of the prefix are complete,
+        # and the block cut by the prefix is always dropped as it is over the budget.
+        prefix_chars = self.budget.get_prefix_chars()
+        while True:
+            if prefix_chars > len(html_str) * FULL_PAGE_RATIO:
+                prefix_chars = len(html_str)
+            result, is_cut = self.purify_decoded_str(
+                html_str[:prefix_chars],
+                compiled_rules,
+                metrics,
+                self.budget,
+                boilerplate_page,
+            )
+            if is_cut or prefix_chars >= len(html_str):
+                metrics.set("input_chars_purified", prefix_chars)
+                return result
+            prefix_chars = int(prefix_chars * self.budget.get_prefix_growth(result))
+
+    def iter_purify_chunks(
+        self,
+        html_str: Union[str, bytes],
+        encoding: str = None,
+        metrics: PurifyMetrics = None,
+        url: str = None,
+    ) -> Iterator[dict]:
+        # yield chunks of `chunk_size` chars, rendered while walking the purified tree
+        metrics = metrics or NULL_METRICS
+        if not html_str:
+            return
+        compiled_rules = self.get_compiled_rules(url, html_str)
+        if isinstance(html_str, (bytes, bytearray)):
+            with metrics.stage("decode"):
+                html_str, encoding = decode_html_bytes(html_str, encoding=encoding)
+        if self.boilerplate:
+            boilerplate_page = self.boilerplate.start_page(
+                self.get_page_host(url, html_str)
+            )
+        else:
+            boilerplate_page = None
+        soup = self.purify_decoded_soup(
+            html_str, compiled_rules, metrics, boilerplate_page
+        )
+        if boilerplate_page:
+            boilerplate_page.finish()
+        if self.budget.enabled:
+            with metrics.stage("truncate"):
+                self.budget.truncate_soup(soup, self.output_format)
+        chunker = HTMLChunker(
+            chunk_size=self.chunk_size or DEFAULT_CHUNK_SIZE,
+            output_format=self.output_format,
+            parser=self.parser,
+        )
+        chunks = chunker.iter_chunks(soup)
+        chunk_count = 0
+        while True:
+            # only time spent in chunking is counted, not in the consumer
+            with metrics.stage("chunk"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            chunk_count += 1
+            yield chunk
+        metrics.set("chunks", chunk_count)
+
+    def purify_output(
+        self, html_str: Union[str, bytes], metrics=NULL_METRICS, url: str = None
+    ) -> Tuple[str, Optional[list]]:
+        # return (output, chunks), where chunks are None unless `chunk_size` is set,
+        # and then the output is the joined chunks
+        if not self.chunk_size:
+            return self.purify_str(html_str, metrics=metrics, url=url), None
+        chunks = list(self.iter_purify_chunks(html_str, metrics=metrics, url=url))
+        return join_chunks(chunks, self.output_format), chunks
+
+    def purify_record(self, record: dict) -> dict:
+        # records come from archives and are not saved, so there is no output_path
+        metrics = self.create_metrics()
+        html = record["html"]
+        if isinstance(html, (bytes, bytearray)) and html:
+            with metrics.stage("decode"):
+                html, _ = decode_html_bytes(
+                    html, content_type=record.get("content_type")
+                )
+        output, chunks = self.purify_output(
+            html, metrics=metrics, url=record.get("url")
+        )
+        res = {"output": output, "output_path": None}
+        if chunks is not None:
+            res["chunks"] = chunks
+        if metrics.enabled:
+            res["metrics"] = metrics.to_dict()
+        return res
+
+
+# up-to-date input of an incremental batch, which is yielded in place of a chunk
+SkippedInput = collections.namedtuple("SkippedInput", ["html_path", "output_path"])
+
+
+# purifiers rebuilt from configs in worker processes, reused across tasks;
+# least recently used ones are dropped, as server requests can each bring a config
+WORKER_PURIFIERS = collections.OrderedDict()
+MAX_WORKER_PURIFIERS = 16
+
+
+def get_worker_purifier(config: dict) -> HTMLPurifier:
+    # packs of the config replace packs of the worker on each task,
+    # as a cached purifier may be used after other packs were set
+    if config.get("rule_packs") is not None:
+        set_rule_packs_state(config["rule_packs"])
+    key = tuple(sorted(config.items()))
+    if key in WORKER_PURIFIERS:
+        WORKER_PURIFIERS.move_to_end(key)
+    else:
+        WORKER_PURIFIERS[key] = HTMLPurifier.from_config(config)
+        while len(WORKER_PURIFIERS) > MAX_WORKER_PURIFIERS:
+            WORKER_PURIFIERS.popitem(last=False)
+    return WORKER_PURIFIERS[key]
+
+
+def purify_html_files_chunk(
+    config: dict, html_paths: list, save: bool = True, input_state: bool = False
+) -> list:
+    purifier = get_worker_purifier(config)
+    return [
+        purifier.purify_file(html_path, save=save, input_state=input_state)
+        for html_path in html_paths
+    ]
 
-        logger.exit_quiet(not self.verbose)
-        return result
+
+def purify_html_records_chunk(config: dict, records: list) -> list:
+    purifier = get_worker_purifier(config)
+    return [purifier.purify_record(record) for record in records]
 
 
 class BatchHTMLPurifier:
-    def __init__(self, purifier: HTMLPurifier):
+    def __init__(
+        self,
+        purifier: HTMLPurifier,
+        executor: Union[
+            Literal["thread", "process"], concurrent.futures.Executor
+        ] = "thread",
+        max_workers: int = None,
+        chunksize: int = None,
+        incremental: bool = False,
+        sink: Union[SinkType, OutputSink] = "file",
+        sink_path: Union[Path, str] = None,
+    ):
         self.html_path_and_purified_content_list = []
         self.done_count = 0
+        # guards progress, results and metrics, which are updated from pool threads
+        self.lock = threading.Lock()
+        self.total_count = None
         self.purifier = purifier
+        self.executor = executor
+        self.max_workers = max_workers
+        self.chunksize = chunksize
+        self.incremental = incremental
+        self.sink = sink
+        self.sink_path = sink_path
+        # only the "file" sink saves outputs in workers, others are written by SinkWriter
+        self.save_files = sink == "file"
+        if incremental and not self.save_files:
+            raise ValueError("`incremental` requires the `file` sink")
+        if incremental:
+            # registered packs are part of the settings, so outputs are purified
+            # again after packs are registered or unregistered
+            self.manifest = BatchManifest(
+                {**purifier.get_settings(), "rule_packs": get_rule_packs_fingerprint()}
+            )
+        else:
+            self.manifest = None
+        self.batch_metrics = BatchMetrics() if purifier.metrics else None
+
+    def make_item(self, html_path, result: dict, skipped: bool = False) -> dict:
+        with self.lock:
+            self.done_count += 1
+            done_count = self.done_count
+        total_str = "?" if self.total_count is None else self.total_count
+        action_str = "Skipped" if skipped else "Purified"
+        self.purifier.log(
+            "success", f"> {action_str} [{done_count}/{total_str}]: [{html_path}]"
+        )
+        item = {
+            "path": html_path,
+            "output": result["output"],
+            "output_path": result["output_path"],
+            "format": self.purifier.output_format,
+            "skipped": skipped,
+        }
+        if "chunks" in result:
+            item["chunks"] = result["chunks"]
+        if self.batch_metrics:
+            item["metrics"] = result.get("metrics")
+            with self.lock:
+                self.batch_metrics.add(html_path, item["metrics"])
+        return item
+
+    def add_item(self, item: dict):
+        with self.lock:
+            self.html_path_and_purified_content_list.append(item)
+
+    def filter_changed_paths(self, html_paths: Iterable) -> Iterator:
+        # up-to-date inputs are replaced by `SkippedInput`, which are not purified,
+        # but kept in place, so that they are yielded in input order if ordered
+        for html_path in html_paths:
+            output_path = self.purifier.get_output_path(html_path)
+            if self.manifest.is_up_to_date(html_path, output_path):
+                yield SkippedInput(html_path, output_path)
+            else:
+                yield html_path
 
     def purify_single_html_file(self, html_path):
         result = self.purifier.purify_file(html_path)
-        self.html_path_and_purified_content_list.append(
-            {
-                "path": html_path,
-                "output": result["output"],
-                "output_path": result["output_path"],
-                "format": self.purifier.output_format,
-            }
-        )
-        self.done_count += 1
+        self.add_item(self.make_item(html_path, result))
 
-        if self.purifier.verbose:
-            logger.success(
-                f"> Purified [{self.done_count}/{self.total_count}]: [{html_path}]"
+    def purify_chunk(self, html_paths: list) -> list:
+        return [
+            self.purifier.purify_file(
+                html_path, save=self.save_files, input_state=self.incremental
             )
+            for html_path in html_paths
+        ]
+
+    def purify_record_chunk(self, records: list) -> list:
+        return [self.purifier.purify_record(record) for record in records]
+
+    def get_max_workers(self) -> int:
+        return self.max_workers or os.cpu_count() or 1
+
+    def get_chunksize(self) -> int:
+        if self.chunksize:
+            return self.chunksize
+        if self.executor == "thread":
+            # threads share the purifier, so there is no IPC to amortize
+            return 1
+        if self.total_count is None:
+            return 8
+        # a few chunks per worker keeps them busy,
+        # while sending many small pages in one task to cut IPC overhead
+        chunks_per_worker = 4
+        return max(
+            1,
+            math.ceil(self.total_count / (self.get_max_workers() * chunks_per_worker)),
+        )
+
+    def create_executor(self) -> concurrent.futures.Executor:
+        if self.executor == "thread":
+            return concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        elif self.executor == "process":
+            return concurrent.futures.ProcessPoolExecutor(self.get_max_workers())
+        else:
+            raise ValueError(f"Unknown executor: {self.executor}")
+
+    def get_executor(self) -> Tuple[concurrent.futures.Executor, bool]:
+        # return (executor, owns_executor)
+        if isinstance(self.executor, concurrent.futures.Executor):
+            return self.executor, False
+        return self.create_executor(), True
+
+    def create_writer(self) -> Optional[SinkWriter]:
+        if self.save_files:
+            return None
+        return SinkWriter(
+            create_sink(self.sink, self.sink_path, verbose=self.purifier.verbose)
+        )
+
+    def iter_chunks(self, items: Iterable) -> Iterator[Union[list, SkippedInput]]:
+        # skipped inputs end the current chunk, and are yielded on their own
+        chunksize = self.get_chunksize()
+        chunk = []
+        for item in items:
+            if isinstance(item, SkippedInput):
+                if chunk:
+                    yield chunk
+                    chunk = []
+                yield item
+                continue
+            chunk.append(item)
+            if len(chunk) >= chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def iter_chunk_results(
+        self,
+        executor: concurrent.futures.Executor,
+        items: Iterable,
+        ordered: bool = False,
+        max_in_flight: int = None,
+        records: bool = False,
+    ) -> Iterator[Tuple[list, list]]:
+        if self.executor == "thread":
+            chunk_func = self.purify_record_chunk if records else self.purify_chunk
+            submit_chunk = lambda chunk: executor.submit(chunk_func, chunk)
+        else:
+            # workers rebuild the purifier from its config, instead of pickling it per task
+            config = self.purifier.get_config()
+            if records:
+                submit_chunk = lambda chunk: executor.submit(
+                    purify_html_records_chunk, config, chunk
+                )
+            else:
+                submit_chunk = lambda chunk: executor.submit(
+                    purify_html_files_chunk,
+                    config,
+                    chunk,
+                    self.save_files,
+                    self.incremental,
+                )
+
+        # only a bounded window of chunks is in flight,
+        # so memory stays constant whatever the batch size
+        max_in_flight = max_in_flight or self.get_max_workers() * 2
+        chunks = self.iter_chunks(items)
+        future_chunks = collections.OrderedDict()
+        try:
+            while True:
+                for chunk in itertools.islice(
+                    chunks, max_in_flight - len(future_chunks)
+                ):
+                    if isinstance(chunk, SkippedInput):
+                        # already resolved, and yielded once it is at the head if ordered
+                        future = concurrent.futures.Future()
+                        future.set_result(None)
+                    else:
+                        future = submit_chunk(chunk)
+                    future_chunks[future] = chunk
+                if not future_chunks:
+                    return
+                if ordered:
+                    done_futures = [next(iter(future_chunks))]
+                else:
+                    done_futures, _ = concurrent.futures.wait(
+                        future_chunks, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                for future in done_futures:
+                    chunk = future_chunks.pop(future)
+                    yield chunk, future.result()
+        finally:
+            for future in future_chunks:
+                future.cancel()
+
+    def iter_purify_files(
+        self,
+        html_paths: Iterable[Union[Path, str]],
+        ordered: bool = False,
+        max_in_flight: int = None,
+    ) -> Iterator[dict]:
+        # yield each result once it is done, in input order if `ordered`,
+        # otherwise in completion order
+        self.total_count = len(html_paths) if hasattr(html_paths, "__len__") else None
+        executor, owns_executor = self.get_executor()
+        writer = self.create_writer()
+        if self.incremental:
+            html_paths = self.filter_changed_paths(html_paths)
+        try:
+            for chunk, results in self.iter_chunk_results(
+                executor, html_paths, ordered=ordered, max_in_flight=max_in_flight
+            ):
+                if isinstance(chunk, SkippedInput):
+                    result = {"output": None, "output_path": chunk.output_path}
+                    yield self.make_item(chunk.html_path, result, skipped=True)
+                    continue
+                for html_path, result in zip(chunk, results):
+                    if self.incremental and result["output_path"]:
+                        self.manifest.record(
+                            html_path,
+                            result["output_path"],
+                            result.get("input_state"),
+                        )
+                    item = self.make_item(html_path, result)
+                    if writer:
+                        writer.write(item)
+                    yield item
+                if self.incremental and self.done_count % 1000 < len(chunk):
+                    self.manifest.save()
+        finally:
+            if owns_executor:
+                executor.shutdown(wait=True)
+            if writer:
+                writer.close()
+            if self.incremental:
+                self.manifest.save()
 
     def purify_files(self, html_paths):
-        self.html_path = html_paths
-        self.total_count = len(self.html_path)
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(self.purify_single_html_file, html_path)
-                for html_path in self.html_path
-            ]
-            for idx, future in enumerate(concurrent.futures.as_completed(futures)):
-                result = future.result()
+        for item in self.iter_purify_files(html_paths):
+            self.add_item(item)
+        return self.html_path_and_purified_content_list
+
+    def iter_purify_records(
+        self,
+        records: Iterable[dict],
+        ordered: bool = False,
+        max_in_flight: int = None,
+    ) -> Iterator[dict]:
+        # records are read lazily and sent to workers in chunks,
+        # so only the in-flight window of pages is held in memory
+        self.total_count = len(records) if hasattr(records, "__len__") else None
+        executor, owns_executor = self.get_executor()
+        writer = self.create_writer()
+        try:
+            for chunk, results in self.iter_chunk_results(
+                executor,
+                records,
+                ordered=ordered,
+                max_in_flight=max_in_flight,
+                records=True,
+            ):
+                for record, result in zip(chunk, results):
+                    item = self.make_item(record["name"], result)
+                    item["url"] = record.get("url")
+                    if writer:
+                        writer.write(item)
+                    yield item
+        finally:
+            if owns_executor:
+                executor.shutdown(wait=True)
+            if writer:
+                writer.close()
 
+    def iter_purify_sources(
+        self,
+        sources: Iterable[Union[Path, str, dict]],
+        source_type: SourceType = "auto",
+        ordered: bool = False,
+        max_in_flight: int = None,
+    ) -> Iterator[dict]:
+        # sources are warc, tar, zip or jsonl files, html files or dirs, or records
+        records = iter_sources_records(
+            sources, source_type=source_type, verbose=self.purifier.verbose
+        )
+        return self.iter_purify_records(
+            records, ordered=ordered, max_in_flight=max_in_flight
+        )
+
+    def purify_sources(
+        self,
+        sources: Iterable[Union[Path, str, dict]],
+        source_type: SourceType = "auto",
+    ):
+        for item in self.iter_purify_sources(sources, source_type=source_type):
+            self.add_item(item)
         return self.html_path_and_purified_content_list
 
 
@@ -301,6 +1035,18 @@ def purify_html_file(
     keep_format_tags: bool = True,
     keep_group_tags: bool = True,
     math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    markdown_backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    chunk_size: int = None,
+    cache: bool = False,
+    cache_path: Union[Path, str] = None,
+    metrics: bool = False,
+    url: str = None,
 ):
     purifier = HTMLPurifier(
         verbose=verbose,
@@ -309,18 +1055,39 @@ def purify_html_file(
         keep_format_tags=keep_format_tags,
         keep_group_tags=keep_group_tags,
         math_style=math_style,
+        markdown_backend=markdown_backend,
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        chunk_size=chunk_size,
+        cache=cache,
+        cache_path=cache_path,
+        metrics=metrics,
     )
-    return purifier.purify_file(html_path)
+    return purifier.purify_file(html_path, url=url)
 
 
 def purify_html_str(
-    html_str: str,
+    html_str: Union[str, bytes],
     verbose: bool = False,
     output_format: Literal["markdown", "html"] = "html",
     keep_href: bool = False,
     keep_format_tags: bool = True,
     keep_group_tags: bool = True,
     math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    markdown_backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    cache: bool = False,
+    cache_path: Union[Path, str] = None,
+    url: str = None,
 ):
     purifier = HTMLPurifier(
         verbose=verbose,
@@ -329,8 +1096,53 @@ def purify_html_str(
         keep_format_tags=keep_format_tags,
         keep_group_tags=keep_group_tags,
         math_style=math_style,
+        markdown_backend=markdown_backend,
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        cache=cache,
+        cache_path=cache_path,
+    )
+    return purifier.purify_str(html_str, url=url)
+
+
+def iter_purify_html_chunks(
+    html_str: Union[str, bytes],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    verbose: bool = False,
+    output_format: Literal["markdown", "html"] = "markdown",
+    keep_href: bool = False,
+    keep_format_tags: bool = True,
+    keep_group_tags: bool = True,
+    math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    url: str = None,
+) -> Iterator[dict]:
+    purifier = HTMLPurifier(
+        verbose=verbose,
+        output_format=output_format,
+        keep_href=keep_href,
+        keep_format_tags=keep_format_tags,
+        keep_group_tags=keep_group_tags,
+        math_style=math_style,
+        markdown_backend="stream",
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        chunk_size=chunk_size,
     )
-    return purifier.purify_str(html_str)
+    yield from purifier.iter_purify_chunks(html_str, url=url)
 
 
 def purify_html_files(
@@ -341,6 +1153,26 @@ def purify_html_files(
     keep_format_tags: bool = True,
     keep_group_tags: bool = True,
     math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    markdown_backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    chunk_size: int = None,
+    boilerplate_threshold: float = None,
+    cache: bool = False,
+    cache_path: Union[Path, str] = None,
+    metrics: bool = False,
+    executor: Union[
+        Literal["thread", "process"], concurrent.futures.Executor
+    ] = "thread",
+    max_workers: int = None,
+    chunksize: int = None,
+    incremental: bool = False,
+    sink: Union[SinkType, OutputSink] = "file",
+    sink_path: Union[Path, str] = None,
 ):
     purifier = HTMLPurifier(
         verbose=verbose,
@@ -349,11 +1181,160 @@ def purify_html_files(
         keep_format_tags=keep_format_tags,
         keep_group_tags=keep_group_tags,
         math_style=math_style,
+        markdown_backend=markdown_backend,
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        chunk_size=chunk_size,
+        boilerplate_threshold=boilerplate_threshold,
+        cache=cache,
+        cache_path=cache_path,
+        metrics=metrics,
+    )
+    batch_purifier = BatchHTMLPurifier(
+        purifier=purifier,
+        executor=executor,
+        max_workers=max_workers,
+        chunksize=chunksize,
+        incremental=incremental,
+        sink=sink,
+        sink_path=sink_path,
     )
-    batch_purifier = BatchHTMLPurifier(purifier=purifier)
     return batch_purifier.purify_files(html_paths)
 
 
+def iter_purify_html_files(
+    html_paths: Iterable[Union[Path, str]],
+    verbose: bool = False,
+    output_format: Literal["markdown", "html"] = "html",
+    keep_href: bool = False,
+    keep_format_tags: bool = True,
+    keep_group_tags: bool = True,
+    math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    markdown_backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    chunk_size: int = None,
+    boilerplate_threshold: float = None,
+    cache: bool = False,
+    cache_path: Union[Path, str] = None,
+    metrics: bool = False,
+    executor: Union[
+        Literal["thread", "process"], concurrent.futures.Executor
+    ] = "thread",
+    max_workers: int = None,
+    chunksize: int = None,
+    incremental: bool = False,
+    sink: Union[SinkType, OutputSink] = "file",
+    sink_path: Union[Path, str] = None,
+    ordered: bool = False,
+    max_in_flight: int = None,
+):
+    purifier = HTMLPurifier(
+        verbose=verbose,
+        output_format=output_format,
+        keep_href=keep_href,
+        keep_format_tags=keep_format_tags,
+        keep_group_tags=keep_group_tags,
+        math_style=math_style,
+        markdown_backend=markdown_backend,
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        chunk_size=chunk_size,
+        boilerplate_threshold=boilerplate_threshold,
+        cache=cache,
+        cache_path=cache_path,
+        metrics=metrics,
+    )
+    batch_purifier = BatchHTMLPurifier(
+        purifier=purifier,
+        executor=executor,
+        max_workers=max_workers,
+        chunksize=chunksize,
+        incremental=incremental,
+        sink=sink,
+        sink_path=sink_path,
+    )
+    return batch_purifier.iter_purify_files(
+        html_paths, ordered=ordered, max_in_flight=max_in_flight
+    )
+
+
+def iter_purify_html_sources(
+    sources: Iterable[Union[Path, str, dict]],
+    verbose: bool = False,
+    output_format: Literal["markdown", "html"] = "html",
+    keep_href: bool = False,
+    keep_format_tags: bool = True,
+    keep_group_tags: bool = True,
+    math_style: Literal["latex", "latex_in_tag", "html"] = "latex",
+    markdown_backend: Literal["soup", "stream"] = "soup",
+    parser: ParserType = "html.parser",
+    prestrip: bool = False,
+    site_rules: Literal["all", "auto"] = "all",
+    max_output_chars: int = None,
+    max_output_tokens: int = None,
+    token_counter: Callable[[str], int] = None,
+    chunk_size: int = None,
+    boilerplate_threshold: float = None,
+    cache: bool = False,
+    cache_path: Union[Path, str] = None,
+    metrics: bool = False,
+    executor: Union[
+        Literal["thread", "process"], concurrent.futures.Executor
+    ] = "thread",
+    max_workers: int = None,
+    chunksize: int = None,
+    sink: Union[SinkType, OutputSink] = "none",
+    sink_path: Union[Path, str] = None,
+    source_type: SourceType = "auto",
+    ordered: bool = False,
+    max_in_flight: int = None,
+):
+    purifier = HTMLPurifier(
+        verbose=verbose,
+        output_format=output_format,
+        keep_href=keep_href,
+        keep_format_tags=keep_format_tags,
+        keep_group_tags=keep_group_tags,
+        math_style=math_style,
+        markdown_backend=markdown_backend,
+        parser=parser,
+        prestrip=prestrip,
+        site_rules=site_rules,
+        max_output_chars=max_output_chars,
+        max_output_tokens=max_output_tokens,
+        token_counter=token_counter,
+        chunk_size=chunk_size,
+        boilerplate_threshold=boilerplate_threshold,
+        cache=cache,
+        cache_path=cache_path,
+        metrics=metrics,
+    )
+    batch_purifier = BatchHTMLPurifier(
+        purifier=purifier,
+        executor=executor,
+        max_workers=max_workers,
+        chunksize=chunksize,
+        sink=sink,
+        sink_path=sink_path,
+    )
+    return batch_purifier.iter_purify_sources(
+        sources, source_type=source_type, ordered=ordered, max_in_flight=max_in_flight
+    )
+
+
 if __name__ == "__main__":
     html_root = Path(__file__).parent / "samples"
     html_paths = sorted(list(html_root.glob("*.html")), key=lambda x: x.name)
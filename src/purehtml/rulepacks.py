@@ -0,0 +1,233 @@
+import fnmatch
+import hashlib
+import json
+import re
+import threading
+
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from .constants import (
+    REMOVE_TAGS,
+    COMMON_REMOVE_CLASSES,
+    COM_163_REMOVE_CLASSES,
+    WIKIPEDIA_REMOVE_CLASSES,
+    DOC_PYTHON_REMOVE_CLASSES,
+    AZURE_REMOVE_CLASSES,
+)
+from .prestrip import HTMLPreStripper
+from .rules import RemoveRuleMatcher
+
+# chars to look into for the page url, if no `</head>` is found before
+HEAD_SNIFF_CHARS = 64 * 1024
+HEAD_END_RE = re.compile(r"</head\s*>", flags=re.IGNORECASE)
+TAG_RE = re.compile(r"<(link|base|meta)\b[^>]*>", flags=re.IGNORECASE)
+ATTR_RE = re.compile(
+    r"""([a-zA-Z_:][\w:.\-]*)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))"""
+)
+
+
+@dataclass(frozen=True)
+class RulePack:
+    # Remove rules of a site.
+    # `hosts` are host patterns: "wikipedia.org" matches the host and its subdomains,
+    # and patterns with "*" are matched as globs, like "docs.*.org".
+    # A pack without hosts applies to all pages.
+    name: str
+    hosts: Tuple[str, ...] = ()
+    remove_tags: Tuple[str, ...] = ()
+    remove_classes: Tuple[str, ...] = ()
+
+    def match_host(self, host: str) -> bool:
+        if not self.hosts:
+            return True
+        for pattern in self.hosts:
+            if "*" in pattern:
+                if fnmatch.fnmatch(host, pattern):
+                    return True
+            elif host == pattern or host.endswith(f".{pattern}"):
+                return True
+        return False
+
+
+# registered packs in order, the first is the common pack
+RULE_PACKS = {}
+RULE_PACKS_LOCK = threading.Lock()
+# bumped on each change of packs, so that compiled rules are rebuilt
+RULE_PACKS_VERSION = 0
+
+
+def register_rule_pack(
+    name: str,
+    hosts: Iterable[str] = (),
+    remove_tags: Iterable[str] = (),
+    remove_classes: Iterable[str] = (),
+) -> RulePack:
+    # register (or replace) a pack; packs are sent to worker processes
+    # in configs of purifiers, so they can be registered at any time
+    pack = RulePack(
+        name=name,
+        hosts=tuple(host.lower() for host in hosts),
+        remove_tags=tuple(remove_tags),
+        remove_classes=tuple(remove_classes),
+    )
+    global RULE_PACKS_VERSION
+    with RULE_PACKS_LOCK:
+        RULE_PACKS[name] = pack
+        RULE_PACKS_VERSION += 1
+    return pack
+
+
+def unregister_rule_pack(name: str):
+    global RULE_PACKS_VERSION
+    with RULE_PACKS_LOCK:
+        RULE_PACKS.pop(name, None)
+        RULE_PACKS_VERSION += 1
+
+
+def get_rule_packs_version() -> int:
+    return RULE_PACKS_VERSION
+
+
+def get_rule_packs_state() -> Tuple[RulePack, ...]:
+    # all registered packs, which are hashable and cheap to pickle
+    with RULE_PACKS_LOCK:
+        return tuple(RULE_PACKS.values())
+
+
+def set_rule_packs_state(packs: Iterable[RulePack]):
+    # replace registered packs with `packs`, e.g. in workers with packs of the parent;
+    # nothing is changed if they are the same, so compiled rules are kept
+    global RULE_PACKS_VERSION
+    packs = tuple(packs)
+    with RULE_PACKS_LOCK:
+        if tuple(RULE_PACKS.values()) == packs:
+            return
+        RULE_PACKS.clear()
+        RULE_PACKS.update((pack.name, pack) for pack in packs)
+        RULE_PACKS_VERSION += 1
+
+
+def get_rule_packs_fingerprint() -> str:
+    # fingerprint of all registered packs, which changes when any pack changes
+    with RULE_PACKS_LOCK:
+        packs = [
+            [pack.name, pack.hosts, pack.remove_tags, pack.remove_classes]
+            for pack in RULE_PACKS.values()
+        ]
+    packs_str = json.dumps(packs)
+    return hashlib.blake2b(packs_str.encode("utf-8"), digest_size=8).hexdigest()
+
+
+# all remove tags are generic elements (like <nav>), so they are in the common pack,
+# and site packs only have class rules
+register_rule_pack(
+    "common", remove_tags=REMOVE_TAGS, remove_classes=COMMON_REMOVE_CLASSES
+)
+register_rule_pack("163", hosts=["163.com"], remove_classes=COM_163_REMOVE_CLASSES)
+register_rule_pack(
+    "wikipedia",
+    hosts=["wikipedia.org"],
+    remove_classes=WIKIPEDIA_REMOVE_CLASSES,
+)
+register_rule_pack(
+    "python_docs", hosts=["docs.python.org"], remove_classes=DOC_PYTHON_REMOVE_CLASSES
+)
+register_rule_pack(
+    "azure",
+    hosts=["learn.microsoft.com", "docs.microsoft.com"],
+    remove_classes=AZURE_REMOVE_CLASSES,
+)
+
+
+def get_host(url: str) -> Optional[str]:
+    # accept both urls and bare hosts
+    if not url:
+        return None
+    url = url.strip()
+    if "//" not in url:
+        url = f"//{url}"
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    return host.lower() if host else None
+
+
+def parse_tag_attrs(tag_str: str) -> dict:
+    attrs = {}
+    for match in ATTR_RE.finditer(tag_str):
+        key = match.group(1).lower()
+        value = next(group for group in match.groups()[1:] if group is not None)
+        attrs.setdefault(key, value)
+    return attrs
+
+
+def detect_page_url(html: Union[str, bytes]) -> Optional[str]:
+    # page url from <link rel=canonical>, <base href> or <meta property=og:url>,
+    # searched with regexes in the head, without parsing the page
+    if isinstance(html, (bytes, bytearray)):
+        html = bytes(html[: HEAD_SNIFF_CHARS * 4]).decode("latin-1")
+    match = HEAD_END_RE.search(html, 0, HEAD_SNIFF_CHARS * 4)
+    head = html[: match.start()] if match else html[:HEAD_SNIFF_CHARS]
+    urls = {}
+    for tag_match in TAG_RE.finditer(head):
+        tag_name = tag_match.group(1).lower()
+        attrs = parse_tag_attrs(tag_match.group(0))
+        if tag_name == "link" and "canonical" in attrs.get("rel", "").lower().split():
+            urls.setdefault("canonical", attrs.get("href"))
+        elif tag_name == "base":
+            urls.setdefault("base", attrs.get("href"))
+        elif tag_name == "meta" and (
+            attrs.get("property", attrs.get("name", "")).lower() == "og:url"
+        ):
+            urls.setdefault("og:url", attrs.get("content"))
+    for key in ["canonical", "base", "og:url"]:
+        if get_host(urls.get(key)):
+            return urls[key]
+    return None
+
+
+def get_rule_pack_names(host: str = None, all_packs: bool = False) -> Tuple[str, ...]:
+    # names of packs which apply to the host, the common pack is always included
+    with RULE_PACKS_LOCK:
+        packs = list(RULE_PACKS.values())
+    if all_packs:
+        return tuple(pack.name for pack in packs)
+    return tuple(
+        pack.name
+        for pack in packs
+        if not pack.hosts or (host and pack.match_host(host))
+    )
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    # Matcher and pre-stripper compiled from a combination of packs,
+    # and the fingerprint of their rules, which is part of cache keys.
+    pack_names: Tuple[str, ...]
+    fingerprint: str
+    rule_matcher: RemoveRuleMatcher
+    prestripper: Optional[HTMLPreStripper]
+
+
+def compile_rule_packs(
+    pack_names: Tuple[str, ...], protect_tags: Iterable[str], prestrip: bool = False
+) -> CompiledRules:
+    with RULE_PACKS_LOCK:
+        packs = [RULE_PACKS[name] for name in pack_names if name in RULE_PACKS]
+    remove_tags = [tag for pack in packs for tag in pack.remove_tags]
+    remove_classes = [pattern for pack in packs for pattern in pack.remove_classes]
+    rules_str = json.dumps([remove_tags, remove_classes])
+    fingerprint = hashlib.blake2b(rules_str.encode("utf-8"), digest_size=8).hexdigest()
+    if prestrip:
+        prestripper = HTMLPreStripper(remove_tags, protect_tags)
+    else:
+        prestripper = None
+    return CompiledRules(
+        pack_names=tuple(pack.name for pack in packs),
+        fingerprint=fingerprint,
+        rule_matcher=RemoveRuleMatcher(remove_tags, remove_classes),
+        prestripper=prestripper,
+    )
@@ -0,0 +1,88 @@
+import re
+
+from typing import Iterable, Optional, Tuple
+
+from .constants import REMOVE_TAGS, REMOVE_CLASSES
+
+# a pattern without regex metachars is matched as a literal token
+LITERAL_PATTERN_RE = re.compile(r"^[\w\-]+$")
+
+
+class RemoveRuleMatcher:
+    def __init__(
+        self,
+        remove_tags: Iterable[str] = REMOVE_TAGS,
+        remove_classes: Iterable[str] = REMOVE_CLASSES,
+        cache_size: int = 10000,
+    ):
+        self.remove_tags = frozenset(remove_tags)
+        self.remove_classes = tuple(dict.fromkeys(remove_classes))
+        self.cache_size = cache_size
+        self.compile()
+
+    def compile(self):
+        # exact class/id tokens hit the hashed set without running any regex
+        self.literal_classes = {
+            pattern.lower(): pattern
+            for pattern in self.remove_classes
+            if LITERAL_PATTERN_RE.match(pattern)
+        }
+        # patterns are searched as substrings (like `re.search`),
+        # so all of them are merged into one alternation, each in a named group
+        self.rule_names = {
+            f"r{idx}": pattern for idx, pattern in enumerate(self.remove_classes)
+        }
+        if self.remove_classes:
+            self.classes_re = re.compile(
+                "|".join(
+                    f"(?P<{name}>{pattern})"
+                    for name, pattern in self.rule_names.items()
+                ),
+                flags=re.IGNORECASE,
+            )
+        else:
+            self.classes_re = None
+        self.cache = {}
+
+    def match_class_id(self, class_id_str: str) -> Optional[str]:
+        if class_id_str in self.cache:
+            return self.cache[class_id_str]
+
+        rule = None
+        for token in class_id_str.lower().split():
+            if token in self.literal_classes:
+                rule = self.literal_classes[token]
+                break
+        else:
+            if self.classes_re and class_id_str.strip():
+                match = self.classes_re.search(class_id_str)
+                if match:
+                    rule = self.rule_names[match.lastgroup]
+
+        # single dict reads and writes are atomic, so threads can share the memo,
+        # at worst recomputing a rule which another thread has just cleared
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[class_id_str] = rule
+        return rule
+
+    def match(self, element) -> Optional[Tuple[str, str]]:
+        # return (kind, rule) of the hit rule, kind is "tag" or "class"
+        if element.name in self.remove_tags:
+            return ("tag", element.name)
+
+        try:
+            class_attr = element.get("class", [])
+            class_str = " ".join(list(class_attr))
+        except:
+            class_str = ""
+
+        try:
+            id_str = element.get("id", "")
+        except:
+            id_str = ""
+
+        rule = self.match_class_id(f"{class_str} {id_str}")
+        if rule:
+            return ("class", rule)
+        return None
@@ -0,0 +1,395 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import socketserver
+import threading
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+from tclogger import logger
+
+from .purehtml import HTMLPurifier, get_worker_purifier
+
+BOOL_OPTIONS = ["keep_href", "keep_format_tags", "keep_group_tags", "prestrip"]
+INT_OPTIONS = ["max_output_chars", "max_output_tokens", "chunk_size"]
+FLOAT_OPTIONS = ["boilerplate_threshold"]
+WARMUP_HTML = "<html><body><div><p>warm <b>up</b></p><math alttext='x'></math></div></body></html>"
+
+
+def warm_worker(config: dict):
+    # build the purifier and run it once, so imports and regexes are ready
+    # before the first request
+    get_worker_purifier(config).purify_str(WARMUP_HTML)
+
+
+def purify_item_task(config: dict, item: dict) -> dict:
+    purifier = get_worker_purifier(config)
+    if item.get("path"):
+        result = purifier.purify_file(
+            item["path"], save=item.get("save", False), url=item.get("url")
+        )
+        res = {"output": result["output"], "output_path": result["output_path"]}
+        if "chunks" in result:
+            res["chunks"] = result["chunks"]
+        return res
+    return purifier.purify_record(item)
+
+
+def parse_options(options: dict, allowed_keys) -> dict:
+    parsed = {}
+    for key, value in options.items():
+        if key not in allowed_keys:
+            raise ValueError(f"Unknown option: {key}")
+        if key in BOOL_OPTIONS and isinstance(value, str):
+            value = value.lower() in ("1", "true", "yes", "on")
+        elif key in INT_OPTIONS and isinstance(value, str):
+            value = int(value) if value else None
+        elif key in FLOAT_OPTIONS and isinstance(value, str):
+            value = float(value) if value else None
+        parsed[key] = value
+    return parsed
+
+
+class ServerOverloaded(Exception):
+    pass
+
+
+class PurifyService:
+    # Pre-forked pool of warm purifier processes, shared by all connections.
+    # Each request reserves one slot per document, and waits up to `queue_timeout`
+    # seconds when `max_pending` slots are taken, then it is rejected,
+    # so that a flood of requests gets 503s instead of growing an unbounded queue.
+    def __init__(
+        self,
+        purifier: HTMLPurifier,
+        max_workers: int = None,
+        max_pending: int = None,
+        timeout: float = None,
+        queue_timeout: float = 1.0,
+        root: str = None,
+    ):
+        self.purifier = purifier
+        # items with `path` are only allowed with a root, and must resolve inside it,
+        # so that clients can not read or write arbitrary files of the server
+        self.root = Path(root).resolve() if root else None
+        self.config = purifier.get_config()
+        # token counters are functions, so they can only be set on the server side
+        self.allowed_keys = set(purifier.get_settings()) - {"token_counter"}
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.pending = 0
+        self.slot_freed = threading.Condition()
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+
+    def warm_up(self):
+        futures = [
+            self.executor.submit(warm_worker, self.config)
+            for _ in range(self.max_workers)
+        ]
+        for future in futures:
+            future.result()
+
+    def reserve(self, count: int):
+        if count > self.max_pending:
+            raise ValueError(f"Batch of {count} exceeds limit of {self.max_pending}")
+        with self.slot_freed:
+            has_slots = self.slot_freed.wait_for(
+                lambda: self.pending + count <= self.max_pending,
+                timeout=self.queue_timeout,
+            )
+            if not has_slots:
+                raise ServerOverloaded(
+                    f"{self.pending} documents pending, limit is {self.max_pending}"
+                )
+            self.pending += count
+
+    def release(self, count: int):
+        with self.slot_freed:
+            self.pending -= count
+            self.slot_freed.notify_all()
+
+    def get_config(self, options: dict) -> dict:
+        # built per request, to send packs registered after the service started
+        return {
+            **self.purifier.get_config(),
+            **parse_options(options or {}, self.allowed_keys),
+        }
+
+    def resolve_item_path(self, item: dict) -> dict:
+        if not item.get("path"):
+            return item
+        if self.root is None:
+            raise ValueError("Items with `path` require the server to run with --root")
+        path = (self.root / item["path"]).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Path is outside of server root: {item['path']}")
+        return {**item, "path": str(path)}
+
+    def purify_items(self, items: list[dict], options: dict = None) -> list[dict]:
+        # documents of a batch run in parallel, results are in the order of items
+        for item in items:
+            if not isinstance(item, dict) or not (item.get("html") or item.get("path")):
+                raise ValueError("Each item requires `html` or `path`")
+        items = [self.resolve_item_path(item) for item in items]
+        config = self.get_config(options or {})
+        self.reserve(len(items))
+        futures = []
+        try:
+            for item in items:
+                future = self.executor.submit(purify_item_task, config, item)
+                # a slot is freed when its task ends, as running tasks can not be
+                # cancelled after a timeout, and still hold a worker
+                future.add_done_callback(lambda _: self.release(1))
+                futures.append(future)
+        except BaseException:
+            self.release(len(items) - len(futures))
+            raise
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=self.timeout))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                results.append({"error": "TimeoutError()"})
+            except Exception as e:
+                results.append({"error": repr(e)})
+        return results
+
+    def get_status(self) -> dict:
+        return {
+            "status": "ok",
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class PurifyRequestHandler(BaseHTTPRequestHandler):
+    # - POST /purify: raw html body, options in query,
+    #   returns the output as text
+    # - POST /purify: json body `{"html"|"path", "url", "save", "options"}`,
+    #   returns `{"output", "output_path"}`, and `"chunks"` with `chunk_size`
+    # - POST /batch: json body `{"items": [{"html"|"path", ...}], "options"}`,
+    #   returns `{"results": [{"output", "output_path"} or {"error"}]}`
+    # - GET /health: status of the pool
+    # HTTP/1.1 keeps connections alive, so clients can pipeline requests.
+    protocol_version = "HTTP/1.1"
+    service: PurifyService = None
+
+    def log_message(self, format, *args):
+        if self.service.config["verbose"]:
+            logger.mesg(f"  * {format % args}")
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, data: dict, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_body(status, body, "application/json; charset=utf-8", headers)
+
+    def send_error_json(self, status: int, message: str, headers=None):
+        self.send_json(status, {"error": message}, headers)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/health":
+            self.send_json(HTTPStatus.OK, self.service.get_status())
+        else:
+            self.send_error_json(HTTPStatus.NOT_FOUND, f"Unknown path: {self.path}")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.read_body()
+        content_type = self.headers.get("Content-Type", "")
+        try:
+            if url.path == "/purify":
+                if content_type.startswith("application/json"):
+                    self.handle_purify_json(json.loads(body))
+                else:
+                    self.handle_purify_raw(
+                        body, content_type, dict(parse_qsl(url.query))
+                    )
+            elif url.path == "/batch":
+                self.handle_batch(json.loads(body))
+            else:
+                self.send_error_json(HTTPStatus.NOT_FOUND, f"Unknown path: {url.path}")
+        except ServerOverloaded as e:
+            self.send_error_json(
+                HTTPStatus.SERVICE_UNAVAILABLE, str(e), {"Retry-After": "1"}
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, repr(e))
+
+    def handle_purify_raw(self, body: bytes, content_type: str, options: dict):
+        item = {"html": body, "content_type": content_type}
+        result = self.service.purify_items([item], options)[0]
+        if "error" in result:
+            self.send_error_json(HTTPStatus.INTERNAL_SERVER_ERROR, result["error"])
+            return
+        output_format = options.get(
+            "output_format", self.service.config["output_format"]
+        )
+        output_type = "text/markdown" if output_format == "markdown" else "text/html"
+        self.send_body(
+            HTTPStatus.OK,
+            result["output"].encode("utf-8"),
+            f"{output_type}; charset=utf-8",
+        )
+
+    def handle_purify_json(self, data: dict):
+        options = data.pop("options", None)
+        result = self.service.purify_items([data], options)[0]
+        if "error" in result:
+            if result["error"].startswith("FileNotFoundError"):
+                status = HTTPStatus.NOT_FOUND
+            else:
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+            self.send_error_json(status, result["error"])
+            return
+        self.send_json(HTTPStatus.OK, jsonify_result(result))
+
+    def handle_batch(self, data: dict):
+        results = self.service.purify_items(data["items"], data.get("options"))
+        self.send_json(
+            HTTPStatus.OK, {"results": [jsonify_result(result) for result in results]}
+        )
+
+
+def jsonify_result(result: dict) -> dict:
+    if "error" in result:
+        return {"error": result["error"]}
+    output_path = result.get("output_path")
+    res = {
+        "output": result["output"],
+        "output_path": str(output_path) if output_path else None,
+    }
+    if "chunks" in result:
+        res["chunks"] = result["chunks"]
+    return res
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects (host, port) like client addresses
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def create_server(
+    service: PurifyService,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    unix_socket: str = None,
+) -> socketserver.BaseServer:
+    handler = type("BoundPurifyRequestHandler", (PurifyRequestHandler,), {})
+    handler.service = service
+    if unix_socket:
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(args: list[str] = None):
+    arg_parser = argparse.ArgumentParser(
+        prog="purehtml-server",
+        description="Serve purehtml over HTTP with a pool of warm workers",
+    )
+    arg_parser.add_argument("--host", type=str, default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--unix-socket", type=str, help="Listen on a unix socket")
+    arg_parser.add_argument("--workers", type=int, default=None)
+    arg_parser.add_argument("--max-pending", type=int, default=None)
+    arg_parser.add_argument("--timeout", type=float, default=None)
+    arg_parser.add_argument("--queue-timeout", type=float, default=1.0)
+    arg_parser.add_argument(
+        "--root", type=str, default=None, help="Allow items with paths under root"
+    )
+    arg_parser.add_argument("--verbose", action="store_true")
+    arg_parser.add_argument("--output-format", type=str, default="html")
+    arg_parser.add_argument("--keep-href", action="store_true")
+    arg_parser.add_argument("--no-format-tags", action="store_true")
+    arg_parser.add_argument("--no-group-tags", action="store_true")
+    arg_parser.add_argument("--math-style", type=str, default="latex")
+    arg_parser.add_argument("--markdown-backend", type=str, default="soup")
+    arg_parser.add_argument("--parser", type=str, default="html.parser")
+    arg_parser.add_argument("--prestrip", action="store_true")
+    arg_parser.add_argument("--site-rules", type=str, default="all")
+    arg_parser.add_argument("--max-output-chars", type=int, default=None)
+    arg_parser.add_argument("--max-output-tokens", type=int, default=None)
+    arg_parser.add_argument("--chunk-size", type=int, default=None)
+    arg_parser.add_argument("--boilerplate-threshold", type=float, default=None)
+    args = arg_parser.parse_args(args)
+
+    purifier = HTMLPurifier(
+        verbose=args.verbose,
+        output_format=args.output_format,
+        keep_href=args.keep_href,
+        keep_format_tags=not args.no_format_tags,
+        keep_group_tags=not args.no_group_tags,
+        math_style=args.math_style,
+        markdown_backend=args.markdown_backend,
+        parser=args.parser,
+        prestrip=args.prestrip,
+        site_rules=args.site_rules,
+        max_output_chars=args.max_output_chars,
+        max_output_tokens=args.max_output_tokens,
+        chunk_size=args.chunk_size,
+        boilerplate_threshold=args.boilerplate_threshold,
+    )
+    service = PurifyService(
+        purifier,
+        max_workers=args.workers,
+        max_pending=args.max_pending,
+        timeout=args.timeout,
+        queue_timeout=args.queue_timeout,
+        root=args.root,
+    )
+    logger.note(f"> Warming up {service.max_workers} workers ...")
+    service.warm_up()
+    server = create_server(
+        service, host=args.host, port=args.port, unix_socket=args.unix_socket
+    )
+    address = args.unix_socket or f"http://{args.host}:{args.port}"
+    logger.success(f"> Serving purehtml on: {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
+
+    # python -m purehtml.server --port 8000
+    # curl -X POST --data-binary @page.html "http://127.0.0.1:8000/purify?output_format=markdown"
@@ -0,0 +1,262 @@
+import json
+import queue
+import re
+import threading
+
+from pathlib import Path
+from typing import Literal, Union
+
+from tclogger import logger
+
+SinkType = Literal["file", "none", "jsonl", "parquet"]
+
+SINK_FIELDS = ["path", "url", "format", "output"]
+
+
+def get_next_shard_idx(root: Path, prefix: str, suffix: str) -> int:
+    # continue after existing shards, instead of overwriting them
+    shard_re = re.compile(rf"^{re.escape(prefix)}-(\d+){re.escape(suffix)}$")
+    shard_idxs = [
+        int(match.group(1))
+        for match in (shard_re.match(path.name) for path in root.glob(f"*{suffix}"))
+        if match
+    ]
+    return max(shard_idxs, default=-1) + 1
+
+
+def item_to_row(item: dict) -> dict:
+    return {
+        field: (str(item[field]) if item.get(field) is not None else None)
+        for field in SINK_FIELDS
+    }
+
+
+def item_to_jsonl_row(item: dict) -> dict:
+    # chunks are kept as a list of objects in jsonl
+    row = item_to_row(item)
+    if item.get("chunks") is not None:
+        row["chunks"] = item["chunks"]
+    return row
+
+
+class OutputSink:
+    def write(self, item: dict):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class NullSink(OutputSink):
+    def write(self, item: dict):
+        pass
+
+
+class JSONLShardSink(OutputSink):
+    # Appends one json line per result to `<prefix>-<idx>.jsonl` shards in `root`.
+    # Lines are buffered and written in large blocks,
+    # and a new shard is started once the current one is full.
+    def __init__(
+        self,
+        root: Union[Path, str],
+        prefix: str = "purified",
+        max_shard_records: int = 100000,
+        max_shard_bytes: int = 256 * 1024 * 1024,
+        buffer_bytes: int = 4 * 1024 * 1024,
+        verbose: bool = False,
+    ):
+        self.root = Path(root)
+        self.prefix = prefix
+        self.max_shard_records = max_shard_records
+        self.max_shard_bytes = max_shard_bytes
+        self.buffer_bytes = buffer_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.shard_idx = get_next_shard_idx(self.root, prefix, ".jsonl")
+        self.shard_file = None
+        self.shard_records = 0
+        self.shard_bytes = 0
+        self.buffer = []
+        self.buffer_size = 0
+        self.verbose = verbose
+
+    def get_shard_path(self) -> Path:
+        return self.root / f"{self.prefix}-{self.shard_idx:05d}.jsonl"
+
+    def write(self, item: dict):
+        line = json.dumps(item_to_jsonl_row(item), ensure_ascii=False) + "\n"
+        line_bytes = line.encode("utf-8")
+        self.buffer.append(line_bytes)
+        self.buffer_size += len(line_bytes)
+        self.shard_records += 1
+        self.shard_bytes += len(line_bytes)
+        if self.buffer_size >= self.buffer_bytes:
+            self.flush()
+        if (
+            self.shard_records >= self.max_shard_records
+            or self.shard_bytes >= self.max_shard_bytes
+        ):
+            self.rotate()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.shard_file is None:
+            self.shard_file = open(self.get_shard_path(), "wb")
+        self.shard_file.write(b"".join(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def rotate(self):
+        self.flush()
+        if self.shard_file is not None:
+            self.shard_file.close()
+            if self.verbose:
+                logger.success(f"  > Saved shard: {self.get_shard_path()}")
+            self.shard_file = None
+            self.shard_idx += 1
+        self.shard_records = 0
+        self.shard_bytes = 0
+
+    def close(self):
+        self.rotate()
+
+
+class ParquetShardSink(OutputSink):
+    # Writes results to `<prefix>-<idx>.parquet` shards in `root`, one row group per
+    # `row_group_size` results. Requires `pip install pyarrow`.
+    def __init__(
+        self,
+        root: Union[Path, str],
+        prefix: str = "purified",
+        max_shard_records: int = 100000,
+        row_group_size: int = 1000,
+        verbose: bool = False,
+    ):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(
+                "Parquet sink requires pyarrow: `pip install pyarrow`"
+            ) from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = pyarrow.schema(
+            [(field, pyarrow.string()) for field in SINK_FIELDS]
+        )
+        self.root = Path(root)
+        self.prefix = prefix
+        self.max_shard_records = max_shard_records
+        self.row_group_size = row_group_size
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.shard_idx = get_next_shard_idx(self.root, prefix, ".parquet")
+        self.shard_writer = None
+        self.shard_records = 0
+        self.rows = []
+        self.verbose = verbose
+
+    def get_shard_path(self) -> Path:
+        return self.root / f"{self.prefix}-{self.shard_idx:05d}.parquet"
+
+    def write(self, item: dict):
+        self.rows.append(item_to_row(item))
+        self.shard_records += 1
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+        if self.shard_records >= self.max_shard_records:
+            self.rotate()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.shard_writer is None:
+            self.shard_writer = self.pq.ParquetWriter(
+                self.get_shard_path(), self.schema
+            )
+        table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+        self.shard_writer.write_table(table)
+        self.rows = []
+
+    def rotate(self):
+        self.flush()
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+            if self.verbose:
+                logger.success(f"  > Saved shard: {self.get_shard_path()}")
+            self.shard_writer = None
+            self.shard_idx += 1
+        self.shard_records = 0
+
+    def close(self):
+        self.rotate()
+
+
+def create_sink(
+    sink: Union[SinkType, OutputSink],
+    sink_path: Union[Path, str] = None,
+    verbose: bool = False,
+) -> OutputSink:
+    if isinstance(sink, OutputSink):
+        return sink
+    if sink == "none":
+        return NullSink()
+    if sink in ("jsonl", "parquet"):
+        if not sink_path:
+            raise ValueError(f"`sink_path` is required for sink: {sink}")
+        if sink == "jsonl":
+            return JSONLShardSink(sink_path, verbose=verbose)
+        return ParquetShardSink(sink_path, verbose=verbose)
+    raise ValueError(f"Unknown sink: {sink}")
+
+
+class SinkWriter:
+    # Writes items to a sink from a dedicated thread, so neither the workers
+    # nor the loop collecting their results wait on serialization and I/O.
+    # The queue is bounded, so a slow sink applies backpressure instead of buffering
+    # the whole batch in memory.
+    STOP = object()
+
+    def __init__(self, sink: OutputSink, max_queue_size: int = 1024):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is self.STOP:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.sink.write(item)
+            except Exception as e:
+                self.error = e
+        try:
+            self.sink.close()
+        except Exception as e:
+            self.error = self.error or e
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, item: dict):
+        self.raise_error()
+        self.queue.put(item)
+
+    def close(self):
+        self.queue.put(self.STOP)
+        self.thread.join()
+        self.raise_error()
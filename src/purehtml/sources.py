@@ -0,0 +1,263 @@
+import gzip
+import json
+import tarfile
+import zipfile
+import zlib
+
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Literal, Optional, Tuple, Union
+
+from tclogger import logger
+
+# a record is a dict of:
+#   name: "<source>::<member>", used as the path of its result
+#   html: str or bytes
+#   url: url of the page, if known
+#   content_type: http Content-Type, used as a charset hint for bytes
+HTML_SUFFIXES = (".html", ".htm", ".xhtml", ".shtml")
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+SourceType = Literal["auto", "warc", "tar", "zip", "jsonl", "html"]
+
+
+def is_html_member(name: str) -> bool:
+    return name.lower().endswith(HTML_SUFFIXES)
+
+
+def make_record(
+    source, name: str, html: Union[str, bytes], url: str = None, content_type=None
+) -> dict:
+    return {
+        "name": f"{source}::{name}",
+        "html": html,
+        "url": url,
+        "content_type": content_type,
+    }
+
+
+def open_maybe_gzip(path: Union[Path, str]) -> BinaryIO:
+    # gzip.open reads multi-member files, like record-wise compressed .warc.gz
+    if str(path).lower().endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def detect_source_type(path: Union[Path, str]) -> str:
+    name = str(path).lower()
+    if name.endswith((".warc", ".warc.gz")):
+        return "warc"
+    if name.endswith(TAR_SUFFIXES):
+        return "tar"
+    if name.endswith(".zip"):
+        return "zip"
+    if name.endswith((".jsonl", ".jsonl.gz", ".ndjson", ".ndjson.gz")):
+        return "jsonl"
+    return "html"
+
+
+def iter_tar_records(path: Union[Path, str]) -> Iterator[dict]:
+    # stream mode reads members in order, without seeking or extracting to disk
+    with tarfile.open(path, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not is_html_member(member.name):
+                continue
+            with tar.extractfile(member) as rf:
+                yield make_record(path, member.name, rf.read())
+
+
+def iter_zip_records(path: Union[Path, str]) -> Iterator[dict]:
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not is_html_member(info.filename):
+                continue
+            yield make_record(path, info.filename, zf.read(info))
+
+
+def iter_jsonl_records(
+    path: Union[Path, str],
+    html_field: str = "html",
+    url_field: str = "url",
+    verbose: bool = False,
+) -> Iterator[dict]:
+    with open_maybe_gzip(path) as rf:
+        for line_idx, line in enumerate(rf, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                if verbose:
+                    logger.warn(f"× Invalid JSON line {line_idx} in [{path}]: {e}")
+                continue
+            html = item.get(html_field) if isinstance(item, dict) else None
+            if not html:
+                continue
+            name = item.get("id", line_idx)
+            yield make_record(path, name, html, url=item.get(url_field))
+
+
+def read_http_headers(lines: list) -> dict:
+    headers = {}
+    for line in lines:
+        key, sep, value = line.partition(b":")
+        if sep:
+            headers[key.strip().decode("latin-1").lower()] = value.strip().decode(
+                "latin-1"
+            )
+    return headers
+
+
+def read_warc_headers(rf: BinaryIO) -> Optional[dict]:
+    # skip the blank lines between records, till the version line
+    while True:
+        line = rf.readline()
+        if not line:
+            return None
+        if line.strip():
+            break
+    if not line.startswith(b"WARC/"):
+        raise ValueError(f"Invalid WARC record start: {line[:32]!r}")
+    lines = []
+    while True:
+        line = rf.readline()
+        if not line or not line.strip():
+            break
+        lines.append(line)
+    return read_http_headers(lines)
+
+
+def dechunk_http_body(body: bytes) -> bytes:
+    chunks = []
+    pos = 0
+    while pos < len(body):
+        line_end = body.find(b"\r\n", pos)
+        if line_end < 0:
+            break
+        size_str = body[pos:line_end].split(b";")[0].strip()
+        try:
+            size = int(size_str, 16)
+        except ValueError:
+            # not really chunked, keep the body as is
+            return body
+        if size == 0:
+            break
+        chunks.append(body[line_end + 2 : line_end + 2 + size])
+        pos = line_end + 2 + size + 2
+    return b"".join(chunks)
+
+
+def decompress_http_body(body: bytes, content_encoding: str) -> Optional[bytes]:
+    content_encoding = content_encoding.strip().lower()
+    if content_encoding in ("", "identity"):
+        return body
+    try:
+        if content_encoding in ("gzip", "x-gzip"):
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if content_encoding == "deflate":
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+    except zlib.error:
+        return None
+    return None
+
+
+def parse_http_response(block: bytes) -> Tuple[Optional[str], Optional[bytes]]:
+    # return (content_type, body) of a raw http response, or (None, None) if not html
+    head_end = block.find(b"\r\n\r\n")
+    sep_len = 4
+    if head_end < 0:
+        head_end = block.find(b"\n\n")
+        sep_len = 2
+    if head_end < 0:
+        return None, None
+    head_lines = block[:head_end].splitlines()
+    if not head_lines or not head_lines[0].startswith(b"HTTP/"):
+        return None, None
+    headers = read_http_headers(head_lines[1:])
+    content_type = headers.get("content-type", "")
+    if not content_type.lower().startswith(HTML_CONTENT_TYPES):
+        return None, None
+    body = block[head_end + sep_len :]
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = dechunk_http_body(body)
+    body = decompress_http_body(body, headers.get("content-encoding", ""))
+    return content_type, body
+
+
+def iter_warc_records(path: Union[Path, str]) -> Iterator[dict]:
+    # html pages from "response" records of http responses, and "resource" records
+    with open_maybe_gzip(path) as rf:
+        while True:
+            headers = read_warc_headers(rf)
+            if headers is None:
+                return
+            block = rf.read(int(headers.get("content-length", 0)))
+            warc_type = headers.get("warc-type", "")
+            block_type = headers.get("content-type", "").lower()
+            content_type = html = None
+            if warc_type == "response" and block_type.startswith("application/http"):
+                content_type, html = parse_http_response(block)
+            elif warc_type == "resource" and block_type.startswith(HTML_CONTENT_TYPES):
+                content_type, html = block_type, block
+            if not html:
+                continue
+            url = headers.get("warc-target-uri")
+            name = headers.get("warc-record-id") or url
+            yield make_record(path, name, html, url=url, content_type=content_type)
+
+
+def iter_html_file_records(path: Union[Path, str]) -> Iterator[dict]:
+    path = Path(path)
+    if path.is_dir():
+        html_paths = sorted(p for p in path.rglob("*") if is_html_member(p.name))
+    else:
+        html_paths = [path]
+    for html_path in html_paths:
+        yield {
+            "name": str(html_path),
+            "html": html_path.read_bytes(),
+            "url": None,
+            "content_type": None,
+        }
+
+
+SOURCE_READERS = {
+    "warc": iter_warc_records,
+    "tar": iter_tar_records,
+    "zip": iter_zip_records,
+    "jsonl": iter_jsonl_records,
+    "html": iter_html_file_records,
+}
+
+
+def iter_source_records(
+    source: Union[Path, str], source_type: SourceType = "auto", verbose: bool = False
+) -> Iterator[dict]:
+    if source_type == "auto":
+        source_type = detect_source_type(source)
+    if source_type not in SOURCE_READERS:
+        raise ValueError(f"Unknown source type: {source_type}")
+    if source_type == "jsonl":
+        # only jsonl lines can be skipped as invalid, and logged
+        yield from iter_jsonl_records(source, verbose=verbose)
+    else:
+        yield from SOURCE_READERS[source_type](source)
+
+
+def iter_sources_records(
+    sources: Iterable[Union[Path, str, dict]],
+    source_type: SourceType = "auto",
+    verbose: bool = False,
+) -> Iterator[dict]:
+    # dicts are taken as records already, so in-memory pages can be mixed in
+    for source in sources:
+        if isinstance(source, dict):
+            yield source
+        else:
+            yield from iter_source_records(
+                source, source_type=source_type, verbose=verbose
+            )
@@ -0,0 +1,96 @@
+from typing import Iterable, List, Optional, Tuple
+
+from bs4 import NavigableString, Tag
+
+
+def find_all_in_tags(
+    root: Tag,
+    tags: Iterable[str],
+    names: Optional[Iterable[str]] = None,
+    is_in: bool = False,
+) -> List[Tuple[Tag, bool]]:
+    # Like `root.find_all(names)`, and also tells whether each element
+    # is one of `tags` or has an ancestor in `tags`.
+    # The state is carried down in one traversal, instead of walking `element.parents`,
+    # so the cost is O(nodes) rather than O(nodes x depth).
+    if not isinstance(tags, (set, frozenset)):
+        tags = set(tags)
+    if not (names is None or isinstance(names, (set, frozenset))):
+        names = set(names)
+
+    results = []
+    stack = [
+        (child, is_in) for child in reversed(root.contents) if isinstance(child, Tag)
+    ]
+    while stack:
+        element, is_in = stack.pop()
+        is_in = is_in or (element.name in tags)
+        if names is None or element.name in names:
+            results.append((element, is_in))
+        stack.extend(
+            (child, is_in)
+            for child in reversed(element.contents)
+            if isinstance(child, Tag)
+        )
+    return results
+
+
+def find_all_contain_tags(
+    root: Tag, tags: Iterable[str], elements: Optional[List[Tag]] = None
+) -> set:
+    # ids of elements which are one of `tags` or have a descendant in `tags`,
+    # computed bottom-up from the document-ordered `elements` (defaults to all)
+    if not isinstance(tags, (set, frozenset)):
+        tags = set(tags)
+    if elements is None:
+        elements = root.find_all()
+    contain_ids = set()
+    for element in reversed(elements):
+        if (element.name in tags) or (id(element) in contain_ids):
+            contain_ids.add(id(element))
+            contain_ids.add(id(element.parent))
+    return contain_ids
+
+
+def find_all_has_text(elements: List[Tag]) -> set:
+    # ids of elements whose `get_text().strip()` is non-empty.
+    # Computed bottom-up in one pass over the document-ordered `elements`,
+    # by collecting the types of non-whitespace strings in each subtree,
+    # so nested elements do not re-walk their subtrees.
+    subtree_types = {}
+    has_text_ids = set()
+    for element in reversed(elements):
+        types = subtree_types.pop(id(element), set())
+        for child in element.contents:
+            if isinstance(child, NavigableString) and child.strip():
+                types.add(type(child))
+
+        interesting_types = (
+            element.interesting_string_types or Tag.MAIN_CONTENT_STRING_TYPES
+        )
+        if isinstance(interesting_types, type):
+            interesting_types = {interesting_types}
+        if any(string_type in interesting_types for string_type in types):
+            has_text_ids.add(id(element))
+
+        if types:
+            subtree_types.setdefault(id(element.parent), set()).update(types)
+    return has_text_ids
+
+
+def find_all_outermost(root: Tag, names: Iterable[str]) -> List[Tag]:
+    # Like `root.find_all(names)`, but does not look into the found elements,
+    # so only the outermost matches are returned, and their subtrees are never walked
+    if not isinstance(names, (set, frozenset)):
+        names = set(names)
+    results = []
+    stack = [child for child in reversed(root.contents) if isinstance(child, Tag)]
+    while stack:
+        element = stack.pop()
+        if element.name in names:
+            results.append(element)
+        else:
+            stack.extend(
+                child for child in reversed(element.contents) if isinstance(child, Tag)
+            )
+    return results